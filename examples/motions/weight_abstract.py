@@ -16,6 +16,8 @@ class BiconvexMotionParams:
         self.gait_period = None     #Total Gait Period
         self.stance_percent = None  #Stance Percent
         self.gait_dt = 0.05         #Gait_dt
+        self.gait_dt_ratio = 1.0    #Growth of the dt per knot after the fine knots (1.0 is a uniform horizon)
+        self.gait_fine_knots = None #Knots with gait_dt before the dt grows (None uses the ik horizon)
         self.phase_offset = None    #Phase Offsets
         self.step_ht = None         #Step Height
         self.contact_offsets = None #Contact offsets (Used to plan feet somewhere other than below the hip)
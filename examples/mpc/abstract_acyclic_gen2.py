@@ -3,6 +3,7 @@
 ## Date : 23/09/2021
 
 import time
+import logging
 import numpy as np
 import pinocchio as pin
 from inverse_kinematics_cpp import InverseKinematics
@@ -10,6 +11,8 @@ from biconvex_mpc_cpp import KinoDynMP
 
 from matplotlib import pyplot as plt
 
+logger = logging.getLogger(__name__)
+
 class TalosAcyclicGen:
 
     def __init__(self, robot, r_urdf):
@@ -81,6 +84,7 @@ class TalosAcyclicGen:
             t : current time into the plan
         """
         self.cnt_plan = np.zeros((self.horizon, len(self.eff_names), 4))
+        cnt_dt = np.zeros(self.horizon)
         ft = np.round( (t - self.params.dt_arr[0] - self.t0),3)
 
         prev_current_eef_used = np.ones(len(self.eff_names))
@@ -120,7 +124,9 @@ class TalosAcyclicGen:
             else:
                 dt = self.params.dt_arr[i]
 
-            self.mp.set_contact_plan(self.cnt_plan[i], dt)
+            cnt_dt[i] = dt
+
+        self.mp.set_contact_plan_horizon(self.cnt_plan, cnt_dt)
 
     def create_costs(self, q, v, t, make_cyclic = False):
         """
@@ -403,9 +409,7 @@ class TalosAcyclicGen:
 
         t3 = time.time()
 
-        print("Cost Time :", t2 - t1)
-        print("Solve Time : ", t3 - t2)
-        print(" ================================== ")
+        logger.debug("Cost Time : %s, Solve Time : %s", t2 - t1, t3 - t2)
 
         optimized_forces = self.mp.return_opt_f()
         xs = self.ik.get_xs()
@@ -465,7 +469,7 @@ class TalosAcyclicGen:
                                  ik_mom_opt = self.ik.return_opt_mom(),\
                                  xs = self.ik.get_xs())
 
-        print("finished saving ...")
+        logger.info("finished saving ...")
         assert False
 
     def plot(self, q, v, plot_force = True):
@@ -3,6 +3,7 @@
 ## Date : 23/09/2021
 
 import time
+import logging
 import numpy as np
 import pinocchio as pin
 from inverse_kinematics_cpp import InverseKinematics
@@ -10,6 +11,8 @@ from biconvex_mpc_cpp import KinoDynMP
 
 from matplotlib import pyplot as plt
 
+logger = logging.getLogger(__name__)
+
 class BoltHumanoidAcyclicGen:
 
     def __init__(self, robot, r_urdf):
@@ -80,6 +83,7 @@ class BoltHumanoidAcyclicGen:
             t : current time into the plan
         """
         self.cnt_plan = np.zeros((self.horizon, len(self.eff_names), 4))
+        cnt_dt = np.zeros(self.horizon)
         ft = np.round( (t - self.params.dt_arr[0] - self.t0),3)
 
         prev_current_eef_used = np.ones(len(self.eff_names))
@@ -119,7 +123,9 @@ class BoltHumanoidAcyclicGen:
             else:
                 dt = self.params.dt_arr[i]
 
-            self.mp.set_contact_plan(self.cnt_plan[i], dt)
+            cnt_dt[i] = dt
+
+        self.mp.set_contact_plan_horizon(self.cnt_plan, cnt_dt)
 
     def create_costs(self, q, v, t, make_cyclic = False):
         """
@@ -141,7 +147,7 @@ class BoltHumanoidAcyclicGen:
         ## Dynamics Costs ##
         X_nom = np.zeros((9*self.horizon))
         if self.params.use_offline_traj:
-            print("time:", t)
+            logger.debug("time: %s", t)
             if (int(t/self.params.dt) < len(self.X_centroidal_offline[0::9])):
                 if (int(t/self.params.dt) + self.horizon <= len(self.X_centroidal_offline[0::9])):
                     X_nom[0 : 9*self.horizon] =\
@@ -254,28 +260,28 @@ class BoltHumanoidAcyclicGen:
         ft = t - self.params.dt_arr[0] - self.t0
         i = 0
         counter = 0
-        print("time_kin:", t)
+        logger.debug("time_kin: %s", t)
         while i < self.ik_horizon + 1:
             if self.params.use_offline_traj:
                 self.dt_arr[min(i,self.ik_horizon-1)] = self.params.dt_arr[min(i,self.ik_horizon-1)]
-                print("lookahead:", i)
+                logger.debug("lookahead: %s", i)
                 if (int(t/self.params.dt) < len(self.X_kinematics_offline[:][:])):
                     if (int(t/self.params.dt) + self.horizon <= len(self.X_kinematics_offline[:][:])):
-                        print("inside horizon")
+                        logger.debug("inside horizon")
                         if i < self.horizon:
-                            print("running within horizon")
+                            logger.debug("running within horizon")
                             self.ik.add_state_regularization_cost_single(i, self.params.state_scale[0][0], \
                                         "xReg", self.params.state_wt[0][0:2*self.rmodel.nv],\
                                                 self.X_kinematics_offline[counter+i])
                         else:
-                            print("terminal within horizon")
+                            logger.debug("terminal within horizon")
                             # account for terminal here.
                             self.ik.add_state_regularization_cost(0, i, self.params.state_scale[0][0], \
                                                                 "xReg", self.params.state_wt[0][0:2*self.rmodel.nv],\
                                                                         self.X_kinematics_offline[counter+i], True)
                     else:
                         if i < self.horizon:
-                            print("running intersecting with horizon")
+                            logger.debug("running intersecting with horizon")
                             if (i < len(self.X_kinematics_offline[:][:]) - int(t/self.params.dt)):
                                 self.ik.add_state_regularization_cost_single(i, self.params.state_scale[0][0], \
                                             "xReg", self.params.state_wt[0][0:2*self.rmodel.nv],\
@@ -285,20 +291,20 @@ class BoltHumanoidAcyclicGen:
                                             "xReg", self.params.state_wt[0][0:2*self.rmodel.nv],\
                                                     self.X_kinematics_offline[-1])
                         else:
-                            print("terminal intersecting with horizon")
+                            logger.debug("terminal intersecting with horizon")
                             self.ik.add_state_regularization_cost(0, i, self.params.state_scale[0][0], \
                                                                 "xReg", self.params.state_wt[0][0:2*self.rmodel.nv],\
                                                                         self.X_kinematics_offline[-1], True)
                 else:
                     if i < self.horizon:
-                        print("running out of horizon")
+                        logger.debug("running out of horizon")
                         self.ik.add_state_regularization_cost_single(i, self.params.state_scale[0][0], \
                                     "xReg", self.params.state_wt[0][0:2*self.rmodel.nv],\
                                             self.X_kinematics_offline[-1])
                         # print("last element of the list", self.X_kinematics_offline[-1])
                         # print("initial configuration", self.params.x0)
                     else:
-                        print("terminal out of horizon")
+                        logger.debug("terminal out of horizon")
                         self.ik.add_state_regularization_cost(0, i, self.params.state_scale[0][0], \
                                                             "xReg", self.params.state_wt[0][0:2*self.rmodel.nv],\
                                                                     self.X_kinematics_offline[-1], True)
@@ -386,10 +392,10 @@ class BoltHumanoidAcyclicGen:
         pin.forwardKinematics(self.rmodel, self.rdata, q, np.zeros(self.rmodel.nv))
         pin.updateFramePlacements(self.rmodel, self.rdata)
         pin.framesForwardKinematics(self.rmodel, self.rdata, q)
-        print(t)
+        logger.debug("%s", t)
         for i in range(len(self.eff_names)):
-            print(self.eff_names[i])
-            print(self.rdata.oMf[self.rmodel.getFrameId(self.eff_names[i])].translation)
+            logger.debug("%s", self.eff_names[i])
+            logger.debug("%s", self.rdata.oMf[self.rmodel.getFrameId(self.eff_names[i])].translation)
 
         t1 = time.time()
         # q[0:2] -= self.q0[0:2] - [0.2,0]
@@ -404,9 +410,7 @@ class BoltHumanoidAcyclicGen:
 
         t3 = time.time()
 
-        print("Cost Time :", t2 - t1)
-        print("Solve Time : ", t3 - t2)
-        print(" ================================== ")
+        logger.debug("Cost Time : %s, Solve Time : %s", t2 - t1, t3 - t2)
 
         optimized_forces = self.mp.return_opt_f()
         xs = self.ik.get_xs()
@@ -466,7 +470,7 @@ class BoltHumanoidAcyclicGen:
                                  ik_mom_opt = self.ik.return_opt_mom(),\
                                  xs = self.ik.get_xs())
 
-        print("finished saving ...")
+        logger.info("finished saving ...")
         assert False
 
     def plot(self, q, v, plot_force = True):
@@ -3,6 +3,7 @@
 ## Date : 6/05/2021
 
 import time
+import logging
 import numpy as np
 import pinocchio as pin
 from inverse_kinematics_cpp import InverseKinematics
@@ -10,6 +11,8 @@ from biconvex_mpc_cpp import BiconvexMP, KinoDynMP
 from gait_planner_cpp import GaitPlanner
 from matplotlib import pyplot as plt
 
+logger = logging.getLogger(__name__)
+
 class AnymalMpcGaitGen:
 
     def __init__(self, robot, r_urdf, x_reg, planning_time, q0, height_map = None):
@@ -123,6 +126,13 @@ class AnymalMpcGaitGen:
         # --- Set up Inverse Kinematics ---
         self.ik_horizon = int(np.round(ik_hor_ratio*self.params.gait_horizon*self.params.gait_period/self.params.gait_dt, 2))
         self.dt_arr = np.zeros(self.horizon)
+        # time step of each knot : gait_dt for the first gait_fine_knots knots (the ik knots by
+        # default), then growing by gait_dt_ratio per knot so a long tail extends the horizon
+        fine_knots = self.ik_horizon if self.params.gait_fine_knots == None else self.params.gait_fine_knots
+        self.gait_dt_arr = self.params.gait_dt*self.params.gait_dt_ratio**np.maximum(0, np.arange(self.horizon) - fine_knots + 1)
+        # time of each knot from the first one
+        self.knot_t = np.arange(self.horizon)*self.params.gait_dt
+        self.knot_t[1:] += np.cumsum(self.gait_dt_arr - self.params.gait_dt)[:-1]
 
         # kino dyn
         self.kd = KinoDynMP(self.r_urdf, self.m, len(self.eff_names), self.horizon, self.ik_horizon)
@@ -170,76 +180,53 @@ class AnymalMpcGaitGen:
         # Contact Plan Matrix: horizon x num_eef x 4: The '4' gives the contact plan and location:
         # i.e. the last vector should be [1/0, x, y, z] where 1/0 gives a boolean for contact (1 = contact, 0 = no cnt)
 
-        for i in range(self.horizon):
-            for j in range(len(self.eff_names)):
-                if i == 0:
-                    if self.gait_planner.get_phase(t, j) == 1:
-                        self.cnt_plan[i][j][0] = 1
-                        self.cnt_plan[i][j][1:4] = np.round(self.rdata.oMf[self.ee_frame_id[j]].translation, 3)
-                        self.prev_cnt[j] = self.cnt_plan[i][j][1:4]
-                    else:
-                        self.cnt_plan[i][j][0] = 0
-                        self.cnt_plan[i][j][1:4] = np.round(self.rdata.oMf[self.ee_frame_id[j]].translation, 3)
-                        #     self.cnt_plan[i][j][1:3] += self.offsets[j]
-
-                else:
-                    #All other time steps
-                    ft = np.round(t + i*self.params.gait_dt,3)
-
-                    if self.gait_planner.get_phase(ft, j) == 1:
-                        #If foot will be in contact
-                        self.cnt_plan[i][j][0] = 1
-                        
-                        if self.cnt_plan[i-1][j][0] == 1:
-                            self.cnt_plan[i][j][1:4] = self.cnt_plan[i-1][j][1:4]
-                        else:
-                            hip_loc = com + np.matmul(R, self.offsets[j])[0:2] + i*self.params.gait_dt*vtrack
-                            raibert_step = 0.5*vtrack*self.params.gait_period*self.params.stance_percent[j] - 0.05*(vtrack - v_des[0:2])
-                            ang_step = 0.5*np.sqrt(z_height/self.gravity)*vtrack
-                            ang_step = np.cross(ang_step, [0.0, 0.0, w_des])
-                        
-                            self.cnt_plan[i][j][1:3] = raibert_step[0:2] + hip_loc + ang_step[0:2]
-
-                            if self.height_map != None:
-                                self.cnt_plan[i][j][3] = self.height_map.getHeight(self.cnt_plan[i][j][1], self.cnt_plan[i][j][2]) +\
-                                                                                self.foot_size
-                            else:
-                                self.cnt_plan[i][j][3] = self.foot_size
-
-                        self.prev_cnt[j] = self.cnt_plan[i][j][1:4]
-
-                    else:
-                        #If foot will not be in contact
-                        self.cnt_plan[i][j][0] = 0
-                        per_ph = np.round(self.gait_planner.get_percent_in_phase(ft, j), 3)
-                        hip_loc = com + np.matmul(R,self.offsets[j])[0:2] + i*self.params.gait_dt*vtrack
-                        ang_step = 0.5*np.sqrt(z_height/self.gravity)*vtrack
-                        ang_step = np.cross(ang_step, [0.0, 0.0, w_des])
-                        
-                        if per_ph < 0.5:
-                            self.cnt_plan[i][j][1:3] = hip_loc + ang_step[0:2]
-                        else:
-                            raibert_step = 0.5*vtrack*self.params.gait_period*self.params.stance_percent[j] - 0.05*(vtrack - v_des[0:2])
-                            self.cnt_plan[i][j][1:3] = hip_loc + ang_step[0:2]
-
-                        #What is this?
-                        if per_ph - 0.5 < 0.02:
-                            self.swing_time[i][j] = 1
-
-                        if self.height_map != None:
-                            self.cnt_plan[i][j][3] = self.height_map.getHeight(self.cnt_plan[i][j][1], self.cnt_plan[i][j][2]) + \
-                                                    self.foot_size
-                        else:
-                            self.cnt_plan[i][j][3] = self.foot_size
-            
-            if i == 0:
-                dt = self.params.gait_dt - np.round(np.remainder(t,self.params.gait_dt),2)
-                if dt == 0:
-                    dt = self.params.gait_dt
-            else:
-                dt = self.params.gait_dt
-            self.mp.set_contact_plan(self.cnt_plan[i], dt)
-            self.dt_arr[i] = dt
+        n_eff = len(self.eff_names)
+        knots = np.arange(self.horizon)
+        eff = np.arange(n_eff)
+
+        # phase and percent in phase of all the end effectors at every knot (horizon x n_eff)
+        ft = np.round(t + self.knot_t, 3)
+        ft[0] = t
+        in_cnt = self.gait_planner.get_phase_table(ft) == 1
+        per_ph = np.round(self.gait_planner.get_percent_in_phase_table(ft), 3)
+
+        # a contact is continued from the previous knot, otherwise the foot lands or swings
+        continued = np.zeros_like(in_cnt)
+        continued[1:] = in_cnt[1:] & in_cnt[:-1]
+        touchdown = in_cnt & ~continued
+
+        # hip locations moving with the desired velocity (horizon x n_eff x 2)
+        hip_offsets = np.array([np.matmul(R, self.offsets[j])[0:2] for j in range(n_eff)])
+        hip_loc = (com + hip_offsets) + self.knot_t[:, None, None]*vtrack
+        raibert_step = 0.5*vtrack*self.params.gait_period*np.asarray(self.params.stance_percent)[:, None] - 0.05*(vtrack - v_des[0:2])
+        ang_step = 0.5*np.sqrt(z_height/self.gravity)*vtrack
+        ang_step = np.cross(ang_step, [0.0, 0.0, w_des])
+
+        # location of the foot at the knots where it lands or swings
+        new_loc = np.zeros((self.horizon, n_eff, 3))
+        new_loc[:, :, 0:2] = np.where(touchdown[:, :, None], raibert_step + hip_loc + ang_step[0:2], hip_loc + ang_step[0:2])
+        new_loc[:, :, 2] = self.foot_size
+        if self.height_map != None:
+            for i, j in zip(*np.nonzero(~continued[1:])):
+                new_loc[i+1, j, 2] = self.height_map.getHeight(new_loc[i+1, j, 0], new_loc[i+1, j, 1]) + self.foot_size
+        new_loc[0] = np.round([self.rdata.oMf[self.ee_frame_id[j]].translation for j in range(n_eff)], 3)
+
+        # continued contacts keep the location of the knot where the contact started
+        cnt_start = np.maximum.accumulate(np.where(continued, 0, knots[:, None]), axis = 0)
+        self.cnt_plan[:, :, 0] = in_cnt
+        self.cnt_plan[:, :, 1:4] = new_loc[cnt_start, eff]
+
+        self.swing_time[1:] = ~in_cnt[1:] & (per_ph[1:] - 0.5 < 0.02)
+        last_cnt = self.horizon - 1 - np.argmax(in_cnt[::-1], axis = 0)
+        has_cnt = in_cnt.any(axis = 0)
+        self.prev_cnt[has_cnt] = self.cnt_plan[last_cnt, eff, 1:4][has_cnt]
+
+        self.dt_arr[:] = self.gait_dt_arr
+        dt = self.params.gait_dt - np.round(np.remainder(t,self.params.gait_dt),2)
+        if dt != 0:
+            self.dt_arr[0] = dt
+
+        self.mp.set_contact_plan_horizon(self.cnt_plan, self.dt_arr)
         
         return self.cnt_plan
 
@@ -369,9 +356,7 @@ class AnymalMpcGaitGen:
 
         t3 = time.time()
 
-        print("Cost Time :", t2 - t1)
-        print("Solve Time : ", t3 - t2)
-        print(" ================================== ")
+        logger.debug("Cost Time : %s, Solve Time : %s", t2 - t1, t3 - t2)
 
         com_opt = self.mp.return_opt_com()
         mom_opt = self.mp.return_opt_mom()
@@ -504,7 +489,7 @@ class AnymalMpcGaitGen:
                                  us = self.ik.get_us(),
                                  cnt_plan = self.cnt_plan)
 
-        print("finished saving ...")
+        logger.info("finished saving ...")
         assert False
 
     def plot_plan(self, q, v, plot_force = True):
@@ -6,6 +6,8 @@
 #ifndef CENTROIDAL_HPP
 #define CENTROIDAL_HPP
 #include <iostream>
+#include <array>
+#include <vector>
 #include <eigen3/Eigen/Dense>
 #include <eigen3/Eigen/Sparse>
 
@@ -14,10 +16,29 @@ namespace dynamics{
     class CentroidalDynamics{
 
         public:
+            // contact plan of the horizon, row n_eff*t + n is [cnt, x, y, z] of end effector n at knot t
+            typedef Eigen::Matrix<double, Eigen::Dynamic, 4, Eigen::RowMajor> ContactPlan;
+            // contact locations of the horizon, row n_eff*t + n is end effector n at knot t
+            typedef Eigen::Matrix<double, Eigen::Dynamic, 3, Eigen::RowMajor> ContactLocations;
+
             CentroidalDynamics(double m, int n_col, int n_eff);
         
             void compute_x_mat(Eigen::VectorXd &X);
             void compute_f_mat(Eigen::VectorXd &F);
+            // b_x at X and b_f at F only (also computed by compute_x_mat and compute_f_mat)
+            void compute_b_x(const Eigen::VectorXd &X);
+            void compute_b_f(const Eigen::VectorXd &F);
+
+            // matrix free products with the dynamics matrices, computed from the contact
+            // plan without assembling A_x and A_f
+            // y = A_x(X)*F
+            void apply_x_mat(const Eigen::VectorXd &X, const Eigen::VectorXd &F, Eigen::VectorXd &y) const;
+            // g = A_x(X)^T*r
+            void apply_x_mat_transpose(const Eigen::VectorXd &X, const Eigen::VectorXd &r, Eigen::VectorXd &g) const;
+            // y = A_f(F)*X (including the initial state rows set by update_x_init)
+            void apply_f_mat(const Eigen::VectorXd &F, const Eigen::VectorXd &X, Eigen::VectorXd &y) const;
+            // g = A_f(F)^T*r
+            void apply_f_mat_transpose(const Eigen::VectorXd &F, const Eigen::VectorXd &r, Eigen::VectorXd &g) const;
             
             void update_x_init(Eigen::VectorXd &x_init){
                 for(unsigned t = 0; t < 9; ++t){
@@ -26,7 +47,16 @@ namespace dynamics{
                 }; 
             };
 
-            void set_contact_arrays(Eigen::MatrixXd cnt_plan, double dt);
+            // sets the contact plan (n_eff x 4) of the next knot
+            void set_contact_arrays(const Eigen::Ref<const Eigen::MatrixXd>& cnt_plan, double dt);
+            // sets the contact plan ((n_col*n_eff) x 4) and time steps of all the knots
+            void set_contact_plan(const Eigen::Ref<const ContactPlan>& cnt_plan, const Eigen::Ref<const Eigen::VectorXd>& dt);
+            // sets the contact location of end effector n at knot t
+            void set_contact_location(int t, int n, const Eigen::Vector3d& r){
+                r_.row(r_row(t, n)) = r.transpose();
+            };
+            // the next set_contact_arrays call sets the first knot again
+            void restart_contact_plan(){ next_knot_ = 0; };
 
             //Update the binary contact array
             void update_contact_array();
@@ -38,22 +68,41 @@ namespace dynamics{
             Eigen::VectorXd x_init_;
         
             // location of the contact point array used to create constraints and for calculating forces/amom
-            // Dimension: n_col_ x n_eff x 3
-            std::vector<Eigen::MatrixXd> r_;
+            // Dimension: (n_col_*n_eff) x 3 with row n_eff*t + n (allocated in the constructor)
+            ContactLocations r_;
 
             // contact array that is used to create the constraints (tells if end effector is in contact)
             // Dimension: n_col_ x n_eff
             Eigen::MatrixXd cnt_arr_;
 
-            // location of contact point at time t
-            Eigen::MatrixXd r_t;
-
             const double m_;
             int n_col_;
             const double n_eff_;
 
             Eigen::VectorXd dt_;
 
+            // cnt_arr_(t,n)*dt_[t], computed when the contact plan is set (n_col_ x n_eff)
+            Eigen::MatrixXd cnt_dt_;
+
+            // knot set by the next set_contact_arrays call
+            int next_knot_ = 0;
+
+        private:
+            // row of end effector n at knot t in r_
+            int r_row(int t, int n) const { return static_cast<int>(n_eff_)*t + n; };
+
+            // (row, column) of the coefficients of A_x written for end effector n at knot t
+            std::array<std::pair<int, int>, 9> x_mat_entries(int t, int n) const;
+            // (row, column) of the coefficients of A_f written for knot t
+            std::array<std::pair<int, int>, 9> f_mat_entries(int t) const;
+            // dt times the sum of the contact forces at knot t
+            Eigen::Vector3d force_sum(const Eigen::VectorXd &F, int t) const;
+
+            // offsets of these coefficients in the value arrays of A_x and A_f (the sparsity
+            // patterns are created in the constructor and do not change)
+            std::vector<int> x_val_idx_;
+            std::vector<int> f_val_idx_;
+
             //TODO: 
     };
 
@@ -36,6 +36,12 @@ namespace gait_planner
         //Get how far into the gait phase (swing or stance) the robot is in for a specific end-effector
         double get_percent_in_phase(double time, int foot_ID);
 
+        //Phase (0 swing, 1 stance) of each end-effector at each time, one row per time
+        Eigen::MatrixXi get_phase_table(Eigen::VectorXd time);
+
+        //How far into the gait phase each end-effector is at each time, one row per time
+        Eigen::MatrixXd get_percent_in_phase_table(Eigen::VectorXd time);
+
         //Pass in a pre-made matrix with the horizon / length you want, and compute
         // the entire contact sequence for a fixed dt
         Eigen::MatrixXi get_contact_phase_plan(Eigen::MatrixXi contact_phase_plan, double time_in, double dt);
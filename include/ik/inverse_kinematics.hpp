@@ -7,6 +7,7 @@
 #define _INVERSE_KINEMATICS_
 
 #include <iostream>
+#include <chrono>
 
 #include "pinocchio/parsers/urdf.hpp"
 #include "pinocchio/multibody/data.hpp"
@@ -48,7 +49,12 @@ namespace ik{
 
             void setup_costs(Eigen::VectorXd dt);
 
-            void optimize(const Eigen::VectorXd& x0);
+            // time_limit_us : time limit of the DDP solve in micro seconds (0 for none). The 
+            // DDP iterations are then run one at a time and stop at the deadline (the first 
+            // one is always completed)
+            void optimize(const Eigen::VectorXd& x0, double time_limit_us = 0.0);
+            // true if the last optimize stopped at its time limit
+            bool return_time_limit_reached(){return time_limit_reached_;};
 
             std::vector<Eigen::VectorXd> get_xs() {return ddp_->get_xs();};
             std::vector<Eigen::VectorXd> get_us() {return ddp_->get_us();};
@@ -128,6 +134,9 @@ namespace ik{
             // ddp solver
             boost::shared_ptr<crocoddyl::ShootingProblem> problem_;
             boost::shared_ptr<crocoddyl::SolverDDP> ddp_;
+            // maximum DDP iterations (default of crocoddyl)
+            const int max_iters_ = 100;
+            bool time_limit_reached_ = false;
 
             // cost related variables
             int sn;
@@ -0,0 +1,97 @@
+// This file contains the logging of the planners. Messages are written into a lock free
+// ring buffer (no console I/O in the solvers) and read from it outside the control loop.
+
+#ifndef LOGGING_HPP
+#define LOGGING_HPP
+
+#include <atomic>
+#include <chrono>
+#include <memory>
+#include <ostream>
+#include <string>
+#include <vector>
+
+namespace logging
+{
+enum class Level {
+    debug,
+    info,
+    warning,
+    error,
+    off
+};
+
+struct Message {
+    Level level;
+    // seconds since the logger was created
+    double time;
+    std::string text;
+};
+
+class Logger
+    {
+    public:
+        // capacity : number of messages kept until they are read (rounded up to a power of 2)
+        Logger(std::size_t capacity);
+
+        void set_level(Level level) { level_.store(level, std::memory_order_relaxed); }
+        Level level() const { return level_.load(std::memory_order_relaxed); }
+        bool enabled(Level level) const { return level >= this->level(); }
+
+        // printf style message. Can be called from several threads, drops the message
+        // if the buffer is full
+        void log(Level level, const char* format, ...)
+        #ifdef __GNUC__
+            __attribute__((format(printf, 3, 4)))
+        #endif
+        ;
+
+        // removes the buffered messages (oldest first). Only one thread should read
+        std::vector<Message> drain();
+
+        // writes the buffered messages to os (not meant for the control loop)
+        void flush(std::ostream& os);
+
+        // messages dropped since the buffer was full
+        std::size_t dropped() const { return dropped_.load(std::memory_order_relaxed); }
+
+    private:
+        // maximum length of a message (longer ones are truncated)
+        static constexpr std::size_t message_size_ = 256;
+
+        struct Slot {
+            // sequence number, tells if the slot is free to write or ready to read
+            std::atomic<std::size_t> seq;
+            Level level;
+            double time;
+            char text[message_size_];
+        };
+
+        std::unique_ptr<Slot[]> slots_;
+        std::size_t mask_;
+        std::atomic<std::size_t> write_pos_{0};
+        std::atomic<std::size_t> read_pos_{0};
+        std::atomic<Level> level_{Level::warning};
+        std::atomic<std::size_t> dropped_{0};
+        std::chrono::steady_clock::time_point t0_;
+    };
+
+// logger shared by all the planners
+Logger& logger();
+
+} //namespace logging
+
+// The level is checked before the message is formatted, so disabled messages only cost
+// a relaxed load. Defining BICONVEX_DISABLE_LOGGING removes the messages at compile time
+#ifdef BICONVEX_DISABLE_LOGGING
+    #define BICONVEX_LOG(level, ...) do {} while (0)
+#else
+    #define BICONVEX_LOG(level, ...) \
+        do { \
+            if (::logging::logger().enabled(level)) { \
+                ::logging::logger().log(level, __VA_ARGS__); \
+            } \
+        } while (0)
+#endif
+
+#endif
@@ -0,0 +1,19 @@
+// This file contains the batch solve of independent biconvex motion planners
+
+#ifndef BATCH_HPP
+#define BATCH_HPP
+
+#include <vector>
+
+#include "motion_planner/biconvex.hpp"
+
+namespace motion_planner
+{
+    // optimizes problems[i] from x_init[i] with num_iters outer iterations. The problems 
+    // (distinct planners with the contact plans, costs and bounds already set) are solved 
+    // in parallel on n_threads threads (0 for one per core)
+    void optimize_batch(const std::vector<BiConvexMP*>& problems, 
+                        const std::vector<Eigen::VectorXd>& x_init, int num_iters, int n_threads);
+}
+
+#endif
@@ -15,17 +15,51 @@
 #include "dynamics/centroidal.hpp"
 #include "solvers/problem.hpp"
 #include "solvers/fista.hpp"
+#include "logging/logging.hpp"
 
 namespace motion_planner
 {
+// exit status of BiConvexMP::optimize
+enum class Status {
+    converged,      // dynamic violation (and dual residual) below the exit tolerances
+    max_iters,      // maximum number of outer iterations reached
+    time_limit,     // time limit reached, the best iterate found is returned
+    diverged        // dynamic violation is NaN
+};
+
 class BiConvexMP{
     public:
+        // columns of the solver telemetry (one row per outer iteration)
+        enum TelemetryField {
+            fista_iters_x, fista_iters_f,   // FISTA iterations
+            step_x, step_f,                 // final FISTA step length estimates (L)
+            line_search_x, line_search_f,   // FISTA backtracking trials
+            obj_x, obj_f,                   // objective values of the subproblems
+            primal_res, dual_res,           // dynamic violation and dual residual norms
+            rho,                            // penalty used in the iteration
+            time_f, time_x, time_update,    // wall clock time of each phase in seconds
+            n_telemetry_fields
+        };
+        typedef Eigen::Matrix<double, Eigen::Dynamic, n_telemetry_fields, Eigen::RowMajor> TelemetryMatrix;
+        // com trajectory seen in the optimal X (rows of 3 with the stride of a knot)
+        typedef Eigen::Map<const Eigen::Matrix<double, Eigen::Dynamic, 3, Eigen::RowMajor>, 
+                           0, Eigen::OuterStride<9>> ComMap;
+
         BiConvexMP(double m, int n_col, int n_eff);
 
-        void set_contact_plan(Eigen::MatrixXd cnt_plan, double dt){
+        // contact plan (n_eff x 4, rows [cnt, x, y, z]) of the next knot. Has to be called 
+        // once per knot before optimize
+        void set_contact_plan(const Eigen::Ref<const Eigen::MatrixXd>& cnt_plan, double dt){
             centroidal_dynamics.set_contact_arrays(cnt_plan, dt);
         };
 
+        // contact plan of all the knots, (n_col*n_eff) x 4 with row n_eff*t + n for end
+        // effector n at knot t, and the time step of each knot
+        void set_contact_plan_horizon(const Eigen::Ref<const dynamics::CentroidalDynamics::ContactPlan>& cnt_plan, 
+                                      const Eigen::Ref<const Eigen::VectorXd>& dt);
+
+        // moves the contact location of end effector n at knot t of the current plan
+        void set_contact_location(int t, int n, const Eigen::Vector3d& r);
 
         Eigen::MatrixXd return_A_x(Eigen::VectorXd X){
             centroidal_dynamics.compute_x_mat(X);  
@@ -60,36 +94,80 @@ class BiConvexMP{
         }
         
         void set_rho(double rho){
-            rho_ = rho;
+            rho_ = rho; rho_init_ = rho;
         }
-        
-        void set_warm_start_vars(Eigen::VectorXd x_wm, Eigen::VectorXd f_wm, Eigen::VectorXd P_wm){
-            prob_data_x.set_warm_x(x_wm);
-            prob_data_f.set_warm_x(f_wm);
-            P_k_ = P_wm;
+
+        // residual balancing of rho in the outer loop : rho is scaled by tau when the primal 
+        // residual is mu times larger than the dual residual (and divided by tau in the 
+        // opposite case). Each optimize call starts from the rho of set_rho again, unless 
+        // keep_rho is set (then the adapted rho is kept for the next call)
+        void set_adaptive_rho(bool use_adaptive_rho, double mu, double tau, bool keep_rho = false){
+            use_adaptive_rho_ = use_adaptive_rho; rho_mu_ = mu; rho_tau_ = tau; keep_rho_ = keep_rho;
+        }
+
+        // exit criteria of the outer loop : the dynamic violation is below primal_tol and 
+        // the dual residual rho*A_x^T*A_f*(X - X_prev) of the x update is below dual_tol
+        // (use infinity to only check the dynamic violation)
+        void set_exit_tol(double primal_tol, double dual_tol){
+            exit_tol = primal_tol; dual_exit_tol_ = dual_tol;
+        }
+
+        // maximum iterations and tolerance of FISTA in the x and f subproblems
+        void set_fista_tol(int max_iters, double fista_tol){
+            maxit = max_iters; tol = fista_tol;
+        }
+
+        // inexact subproblems : the FISTA tolerance of an outer iteration is 
+        // max(fista_tol, factor*dynamic violation of the previous one) (0 to disable)
+        void set_inexact_tol(double factor){
+            inexact_factor_ = factor;
         }
 
+        // range of the adaptive rho
+        void set_rho_limits(double rho_min, double rho_max){
+            rho_min_ = rho_min; rho_max_ = rho_max;
+        }
+        
+        // the warm start is copied into the solver buffers, it is rejected (none of it is
+        // applied) if one of the sizes is wrong
+        void set_warm_start_vars(const Eigen::Ref<const Eigen::VectorXd>& x_wm, 
+                                 const Eigen::Ref<const Eigen::VectorXd>& f_wm, 
+                                 const Eigen::Ref<const Eigen::VectorXd>& P_wm);
+
         void set_bounds_x(Eigen::VectorXd lb, Eigen::VectorXd ub) 
                 {prob_data_x.lb_ = lb; prob_data_x.ub_ = ub;}
 
         void set_bounds_f(Eigen::VectorXd lb, Eigen::VectorXd ub) 
-                {prob_data_f.lb_ = lb; prob_data_f.ub_ = ub;}
+                {prob_data_f.lb_ = lb; prob_data_f.ub_ = ub;
+                 f_max_.setConstant(std::numeric_limits<double>::quiet_NaN());}
 
         // box constraints created on parameters and contact plan
         void create_bound_constraints(Eigen::MatrixXd b, double fx_max, double fy_max, double fz_max);
+        // force limits [fx_max, fy_max, fz_max] of each end effector and knot, 
+        // (n_col*n_eff) x 3 with row n_eff*t + n, in the frame of the friction cone. The 
+        // limits are only enforced by the cone projection if enforce is set (the cone is 
+        // capped at fz_max and the tangential forces are clamped to fx_max and fy_max)
+        void set_force_limits(Eigen::MatrixXd f_max, bool enforce = false);
         // creates basic quadratic costs for optimizing X
-        void create_cost_X(Eigen::VectorXd W_X, Eigen::VectorXd W_X_ter, Eigen::VectorXd X_ter, Eigen::VectorXd X_nom);
-        void create_cost_F(Eigen::VectorXd W_F);
+        void create_cost_X(const Eigen::Ref<const Eigen::VectorXd>& W_X, const Eigen::Ref<const Eigen::VectorXd>& W_X_ter, 
+                           const Eigen::Ref<const Eigen::VectorXd>& X_ter, const Eigen::Ref<const Eigen::VectorXd>& X_nom);
+        void create_cost_F(const Eigen::Ref<const Eigen::VectorXd>& W_F);
         void update_nomimal_com_mom(Eigen::MatrixXd opt_com, Eigen::MatrixXd opt_mom);
  
-        void set_rotation_matrix_f(Eigen::MatrixXd rot_matrix)
-        {
-            prob_data_f.rotation_matrices.push_back(rot_matrix);
-            prob_data_f.rotation_matrices_trans.push_back(rot_matrix.transpose());
-        }
+        // rotation of the friction cone of end effector n at knot t (z axis along the normal)
+        void set_rotation_matrix_f(int t, int n, Eigen::Matrix3d rot_matrix);
+
+        // surface normals of the contacts, (n_col*n_eff) x 3 with row n_eff*t + n 
+        // for end effector n at knot t
+        void set_contact_normals(Eigen::MatrixXd normals);
 
 
-        void optimize(Eigen::VectorXd x_init, int no_iters);
+        // time_limit_us : wall clock time limit of the solve in micro seconds (0 for none). 
+        // When it is reached the iterate with the lowest dynamic violation is returned.
+        // optimize only uses the members of this planner (and the thread safe logger), so
+        // different planners can be solved in parallel, but a planner must not be accessed
+        // from another thread during its solve
+        void optimize(Eigen::VectorXd x_init, int no_iters, double time_limit_us = 0.0);
 
         void optimize_osqp(Eigen::VectorXd x_init, int no_iters);
 
@@ -102,34 +180,132 @@ class BiConvexMP{
         //      : ub_fin = new final upper bound constraints, not ALL bounds (i.e. should be length 
         void update_bounds_x(Eigen::VectorXd lb_fin, Eigen::VectorXd ub_fin);
 
+        //Update force limits for MPC
+        //Inputs: f_max_fin = force limits of the new final knot (n_eff x 3)
+        void update_bounds_f(Eigen::MatrixXd f_max_fin);
+
         //Update constraint Matrix A_x, and b_x
         void update_constraints_x();
 
-        //Shift cost functions, constraints, and solutions
-        void shift_horizon();
+        //Shift the solutions (X, F and the dual P) by n_knots knot points to warm start the
+        //next MPC cycle. The new final knots of X are extrapolated with the final velocity, 
+        //the new final forces are held and the dual of the new final dynamics constraints is
+        //zero. Has to be called after the contact plan of the new cycle is set. The forces
+        //stay in newtons, they are divided by the mass before set_warm_start_vars
+        void shift_horizon(int n_knots = 1);
         
+        // horizon length and number of end effectors the planner was built with
+        int return_n_col() const {return n_col_;}
+        int return_n_eff() const {return n_eff_;}
 
-        Eigen::VectorXd return_opt_x(){
+        // the solutions are returned as references to the solver buffers (no copies), 
+        // they are overwritten by the next optimize
+        const Eigen::VectorXd& return_opt_x(){
             return prob_data_x.x_k;
         }
 
-        Eigen::VectorXd return_opt_f(){
+        const Eigen::VectorXd& return_opt_f(){
             return prob_data_f.x_k;
         }
 
-        Eigen::VectorXd return_opt_p(){
+        const Eigen::VectorXd& return_opt_p(){
             return P_k_;
         }
 
-        Eigen::MatrixXd return_opt_com();
-        Eigen::MatrixXd return_opt_mom();
+        // (n_col + 1) x 3 view on the com trajectory in the optimal X
+        ComMap return_opt_com(){
+            return ComMap(prob_data_x.x_k.data(), n_col_ + 1, 3);
+        }
+
+        // (n_col + 1) x 6 momentum trajectory (de normalized with the mass)
+        const Eigen::MatrixXd& return_opt_mom();
 
+        // exit status and dynamic violation of the returned iterate of the last optimize
+        Status return_status(){
+            return status_;
+        }
+
+        double return_residual(){
+            return residual_;
+        }
+
+        // dynamic violation of each outer iteration of the last optimize (collect_statistics)
         std::vector<double> return_dyn_viol_hist(){
             return dyn_violation_hist_;
         }
 
+        // records the telemetry of up to max_iters outer iterations of each optimize 
+        // (0 disables it). The buffer is allocated here and reset by every optimize
+        void set_telemetry(int max_iters){
+            telemetry_.setZero(max_iters, n_telemetry_fields);
+            n_telemetry_ = 0;
+        }
+
+        // telemetry of the last optimize (a view on the buffer, valid until the next one)
+        Eigen::Map<TelemetryMatrix> return_telemetry(){
+            return Eigen::Map<TelemetryMatrix>(telemetry_.data(), n_telemetry_, n_telemetry_fields);
+        }
+
         void set_friction_coefficient(double mu) {
             fista_f.set_friction_coefficient(mu);
+            mu_.setConstant(n_col_*n_eff_, mu);
+        }
+
+        // friction coefficient of each end effector and knot (index n_eff*t + n)
+        void set_friction_coefficients(Eigen::VectorXd mu);
+
+        //Shift friction coefficients for MPC by one knot point
+        //Inputs: mu_fin = friction coefficients of the new final knot (length n_eff)
+        void update_friction_coefficients(Eigen::VectorXd mu_fin);
+
+        // momentum scheme of FISTA for the x and f subproblems
+        void set_acceleration_x(function::Acceleration acceleration) {
+            prob_data_x.set_acceleration(acceleration);
+        }
+
+        void set_acceleration_f(function::Acceleration acceleration) {
+            prob_data_f.set_acceleration(acceleration);
+        }
+
+        // total FISTA iterations of the x and f subproblems in the last optimize
+        Eigen::VectorXi return_fista_iters(){
+            return fista_iters_;
+        }
+
+        // Jacobi scaling of the x and f subproblems. The scaled hessians have a unit
+        // diagonal, so the FISTA line search restarts from L = 1
+        void set_scaling(bool use_scaling) {
+            prob_data_x.set_scaling(use_scaling, 1);
+            prob_data_f.set_scaling(use_scaling, 3);
+            if (use_scaling){
+                fista_x.set_l0(1.0);
+                fista_f.set_l0(1.0);
+            }
+            else{
+                fista_x.set_l0(2.25e6);
+                fista_f.set_l0(506.25);
+            }
+        }
+
+        // the subproblems use matrix free products with the centroidal dynamics instead
+        // of assembling A_x and A_f. The Jacobi scaling (set_scaling) and the fixed step
+        // need the assembled hessians, so the matrices are still assembled while they are on
+        void set_matrix_free(bool use_matrix_free) {
+            use_matrix_free_ = use_matrix_free;
+        }
+
+        // the f subproblem only has the forces of the end effectors in contact, the 
+        // others are zero (return_opt_f keeps the full layout)
+        void set_compress_forces(bool compress_forces) {
+            compress_forces_ = compress_forces;
+        }
+
+        // constant FISTA step length from a bound of the hessian, no line search (the 
+        // hessians are assembled then, like for the Jacobi scaling)
+        void set_fixed_step(bool use_fixed_step) {
+            use_fixed_step_ = use_fixed_step;
+            fista_x.set_fixed_step(use_fixed_step);
+            fista_f.set_fixed_step(use_fixed_step);
         }
 
         void set_robot_mass(double m) {
@@ -142,10 +318,52 @@ class BiConvexMP{
         double m_;
 
     private:
+        // residual balancing update of rho_, rescales the scaled dual P_k_ accordingly
+        void update_rho();
+        // scales rho_ (and the scaled dual P_k_ and the FISTA step lengths with it)
+        void scale_rho(double scale);
+
+        bool use_fixed_step_ = false;
+        bool use_matrix_free_ = false;
+        // true if the current optimize uses the matrix free products
+        bool matrix_free_ = false;
+
+        // sets up prob_data_fc_ with the forces in contact of prob_data_f
+        void compress_f_problem();
+        // A_xc_ from the columns of the forces in contact of A_x
+        void compress_x_mat();
+        // forces in contact of f (full layout) and back (the other forces are zero)
+        void gather_f(const Eigen::VectorXd& f, Eigen::VectorXd& f_c) const;
+        void scatter_f(const Eigen::VectorXd& f_c, Eigen::VectorXd& f) const;
+
+        bool compress_forces_ = false;
+        // f subproblem with the forces in contact only (3 per cone)
+        function::ProblemData prob_data_fc_;
+        // cones in contact (index n_eff*t + n) and their friction coefficients
+        std::vector<int> f_active_;
+        Eigen::VectorXd mu_c_;
+        // contacts and pattern of Q_f the cost of prob_data_fc_ was built for, and the
+        // position of each entry of Q_f in the values of Q_c (-1 if it is dropped)
+        std::vector<int> q_c_active_;
+        std::vector<int> q_f_outer_, q_f_inner_;
+        std::vector<int> q_c_idx_;
+        // columns of A_x of the forces in contact
+        Eigen::SparseMatrix<double> A_xc_;
+        // full layout scratch force vector of the matrix free products
+        Eigen::VectorXd f_full_;
+
         // centroidal dynamics class
         dynamics::CentroidalDynamics centroidal_dynamics;
         // penalty term on dynamic violation
         double rho_ = 1e+5;
+        double rho_init_ = 1e+5;
+        bool keep_rho_ = false;
+        // adaptive penalty parameters
+        bool use_adaptive_rho_ = false;
+        double rho_mu_ = 10.0;
+        double rho_tau_ = 2.0;
+        double rho_min_ = 1e+4;
+        double rho_max_ = 1e+8;
         // initial step length
         double L0_ = 1e2;
         // line search parameter
@@ -158,6 +376,10 @@ class BiConvexMP{
         double tol = 1e-5;
         // tolerance for exiting biconvex
         double exit_tol = 1e-3;
+        // dual residual tolerance for exiting biconvex
+        double dual_exit_tol_ = std::numeric_limits<double>::infinity();
+        // inner tolerance factor of the inexact subproblems
+        double inexact_factor_ = 0.0;
 
         int n_col_ = 0;
         int n_eff_ = 0;
@@ -173,8 +395,7 @@ class BiConvexMP{
         // solver for f optimization
         solvers::FISTA fista_f;
 
-        // optimal CoM and Momentum trajectory (required for IK)
-        Eigen::MatrixXd com_opt_;
+        // optimal Momentum trajectory (required for IK)
         Eigen::MatrixXd mom_opt_;
         
         #ifdef USE_OSQP
@@ -189,6 +410,37 @@ class BiConvexMP{
 
         bool log_statistics = false;
         std::vector<double> dyn_violation_hist_;
+        // telemetry buffer and number of recorded outer iterations
+        TelemetryMatrix telemetry_;
+        int n_telemetry_ = 0;
+        // X before the last x optimization (for the dual residual)
+        Eigen::VectorXd x_prev_;
+        // X - x_prev_ (dual residual)
+        Eigen::VectorXd x_diff_;
+        // change of the dynamic violation through the last x optimization
+        Eigen::VectorXd dyn_violation_diff_;
+        // A_x^T*dyn_violation_diff_, the dual residual is rho times it
+        Eigen::VectorXd dual_res_;
+        // scratch of update_rho : A_f*X, A_x^T*A_f*X and the gradient of the force cost
+        Eigen::VectorXd A_f_x_;
+        Eigen::VectorXd A_x_A_f_x_;
+        Eigen::VectorXd grad_f_;
+        // FISTA iterations of the x and f subproblems
+        Eigen::VectorXi fista_iters_;
+        // exit status and dynamic violation of the last optimize
+        Status status_ = Status::max_iters;
+        double residual_ = 0.0;
+        // iterate with the lowest dynamic violation (time limited solves), with its dual
+        // and rho
+        Eigen::VectorXd x_best_;
+        Eigen::VectorXd f_best_;
+        Eigen::VectorXd p_best_;
+        double rho_best_ = 1e+5;
+
+        // force limits used for all end effectors and knots (NaN if not uniform)
+        Eigen::Vector3d f_max_;
+        // friction coefficient of each end effector and knot
+        Eigen::VectorXd mu_;
 
     };
 }
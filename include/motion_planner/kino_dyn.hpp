@@ -20,10 +20,24 @@ namespace motion_planner{
             ik::InverseKinematics* return_ik(){return &ik;};
 
             void set_warm_starts();
-            void optimize(Eigen::VectorXd q, Eigen::VectorXd v, int dyn_iters, int kino_dyn_iters);
+            // time_limit_us : time limit of the solve in micro seconds (0 for none). The 
+            // dynamics stop once they used their share of it, the IK gets the time left until
+            // the deadline (it can overrun it by one DDP iteration). return_status is
+            // time_limit if either of them stopped at its limit
+            void optimize(Eigen::VectorXd q, Eigen::VectorXd v, int dyn_iters, int kino_dyn_iters,
+                          double time_limit_us = 0.0);
 
             void set_com_tracking_weight(Eigen::VectorXd wt_com){wt_com_ = wt_com;};
             void set_mom_tracking_weight(Eigen::VectorXd wt_mom){wt_mom_ = wt_mom;};
+            // warm start from the previous solution shifted by n_knots knots, the knots that
+            // passed between two calls (only the current state is used otherwise)
+            void set_warm_start_shift(bool use_shift, int n_knots = 1)
+                {use_shift_ = use_shift; shift_knots_ = n_knots;};
+            // share of the time limit reserved for the IK
+            void set_ik_time_fraction(double ik_time_fraction){ik_time_fraction_ = ik_time_fraction;};
+            // status of the last optimize (the one of the dynamics unless the IK reached 
+            // the time limit)
+            Status return_status(){return status_;};
             void compute_solve_times(){profile_code = 1;};
             Eigen::VectorXd return_solve_times(){return solve_times;};
 
@@ -45,6 +59,10 @@ namespace motion_planner{
             Eigen::VectorXd P_wm; // warm start P
             
             int n = 0; // number of times kino_dyn has been called
+            bool use_shift_ = false; // shifted warm starts after the first call
+            int shift_knots_ = 1;
+            double ik_time_fraction_ = 0.3;
+            Status status_ = Status::max_iters;
             int dyn_col_;
             int ik_col_;
 
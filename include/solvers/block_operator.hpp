@@ -0,0 +1,53 @@
+#ifndef BLOCK_OPERATOR_HPP
+#define BLOCK_OPERATOR_HPP
+
+#include <eigen3/Eigen/Dense>
+#include <eigen3/Eigen/Sparse>
+#include <vector>
+
+namespace function
+{
+// Block sparse linear operator for the constraint matrices of the centroidal 
+// subproblems. The rows are split into blocks of 9 (one per knot) and the columns
+// into blocks of 3 (one end effector force), and only the fixed size 9x3 blocks 
+// holding non zeros are stored. A_x has one such block per end effector and knot.
+class BlockRowOperator 
+    {
+    public:
+        static const int block_rows = 9;
+        static const int block_cols = 3;
+        typedef Eigen::Matrix<double, block_rows, block_cols> Block;
+
+        BlockRowOperator(){};
+
+        // builds the block structure from the sparsity pattern of A (compressed).
+        // Returns false if A can not be stored efficiently in blocks 
+        bool analyze_pattern(const Eigen::SparseMatrix<double>& A);
+
+        // copies the values of A into the blocks (A must have the analyzed pattern)
+        void set_values(const Eigen::SparseMatrix<double>& A);
+
+        // y = A*x
+        void apply(const Eigen::VectorXd& x, Eigen::VectorXd& y) const;
+        // x = A^T*y
+        void apply_transpose(const Eigen::VectorXd& y, Eigen::VectorXd& x) const;
+
+        int rows() const { return rows_; }
+        int cols() const { return cols_; }
+
+    private:
+        int rows_ = 0;
+        int cols_ = 0;
+
+        // blocks of row block b are block_ptr_[b] <= k < block_ptr_[b+1]
+        std::vector<int> block_ptr_;
+        // first column of block k
+        std::vector<int> block_col_;
+        // values of the blocks (column major, one after the other)
+        std::vector<Block, Eigen::aligned_allocator<Block>> blocks_;
+        // position in the block values of every non zero of A
+        std::vector<int> value_idx_;
+    };
+} //namespace function
+
+#endif
@@ -31,17 +31,46 @@ class FISTA
         void set_beta(double beta) { beta_ = beta; }
         //Set l0
         void set_l0(double l0) { L_ = l0; }
+        //Scale the current step length estimate (e.g. when the penalty of the problem changes)
+        void scale_l(double scale) { L_ *= scale; }
+        //Current step length estimate
+        double get_l() const { return L_; }
 
         //Use Second Order Cone Projection
         void set_soc_true() { use_soc_projection_ = true; }
 
-        //Set Friction Cone
-        void set_friction_coefficient(double mu) { mu_ = mu; }
+        //Set Friction Cone (same coefficient for all contacts)
+        void set_friction_coefficient(double mu) { mu_ = mu; mu_arr_.setConstant(mu_); }
+
+        //Set friction coefficient of each cone (one per end effector and knot)
+        void set_friction_coefficients(const Eigen::VectorXd& mu) { mu_arr_ = mu.transpose().array(); }
+
+        //Stop optimize at the deadline (checked every iteration)
+        void set_deadline(std::chrono::steady_clock::time_point deadline) {
+            deadline_ = deadline; use_deadline_ = true;
+        }
+        void clear_deadline() { use_deadline_ = false; }
+
+        //Constant step length 1/L without line search, L is the Gershgorin bound of the 
+        //largest eigen value of ATA_ (from its values, so the cost per iteration does not 
+        //change). Matrix free problems keep the line search
+        void set_fixed_step(bool use_fixed_step) {
+            use_fixed_step_ = use_fixed_step;
+        }
 
     private:
         //Computes step length
         void compute_step_length(Eigen::VectorXd y_k);
 
+        //Gradient step from y_k into y_k_1 (in the scaled variables if scaling is used)
+        void gradient_step(function::ProblemData & prob_data_);
+
+        //Squared norm of y_diff in the scaled variables
+        double step_norm_sq(function::ProblemData & prob_data_);
+
+        //Checks if the momentum should be restarted (depends on the acceleration scheme)
+        bool restart_momentum(function::ProblemData & prob_data_);
+
         //Computes second order cone projection for constraints
         void SoC_projection(function::ProblemData & prob_data_);
 
@@ -52,12 +81,31 @@ class FISTA
         double L_ = 150;
         double beta_ = 1.5;
 
-        double soc_norm = 0;
+        typedef Eigen::Array<double, 1, Eigen::Dynamic> RowArrayXd;
+        //friction coefficient and scratch arrays of the cone projection (one entry per cone)
+        RowArrayXd mu_arr_;
+        RowArrayXd soc_norm_;
+        RowArrayXd soc_proj_;
+        RowArrayXd soc_scale_;
+        Eigen::Array<bool, 1, Eigen::Dynamic> soc_inside_;
 
         double t_k;
         double t_k_1;
+        //objective at x_k (function value restart)
+        double obj_k = 0.0;
+        //momentum of the greedy scheme
+        double greedy_momentum_ = 1.0;
 
         double mu_ = 1.0;
+
+        //Deadline of optimize
+        bool use_deadline_ = false;
+        std::chrono::steady_clock::time_point deadline_;
+
+        //Fixed step length parameters
+        bool use_fixed_step_ = false;
+        //fixed step used by the current solve (the problem has a hessian bound)
+        bool fixed_step_active_ = false;
     };
 } //namespace solvers
 
@@ -4,38 +4,97 @@
 #include <eigen3/Eigen/Dense>
 #include <eigen3/Eigen/Sparse>
 #include <chrono>
+#include <functional>
 #include <memory>
+#include <vector>
+
+#include "solvers/block_operator.hpp"
 
 namespace function
 {
+// Momentum schemes of FISTA
+enum class Acceleration {
+    nesterov,           // plain Nesterov momentum
+    gradient_restart,   // adaptive restart when the momentum opposes the gradient step
+    function_restart,   // adaptive restart when the objective increases
+    greedy              // constant momentum with gradient restart (non monotone)
+};
+
 class ProblemData 
     {
     public:
         ProblemData(int state, int horizon);
 
+        // changes the number of knots (the variables, bounds and cost are set to zero)
+        void resize(int horizon);
+
         // this sets the data for the optimization problem
-        void set_data(Eigen::SparseMatrix<double> A, Eigen::VectorXd b, 
-                      Eigen::VectorXd P_k, double rho);
+        void set_data(const Eigen::SparseMatrix<double>& A, const Eigen::VectorXd& b, 
+                      const Eigen::VectorXd& P_k, double rho);
+
+        // matrix free constraint : A is only given through its products y = A*x and
+        // x = A^T*y. The operators are used by the set_data call without A below
+        typedef std::function<void(const Eigen::VectorXd&, Eigen::VectorXd&)> Operator;
+        void set_operator(Operator apply, Operator apply_transpose) {
+            op_apply_ = apply; op_apply_transpose_ = apply_transpose;
+        }
+
+        // this sets the data of the matrix free problem (ATA_ is not formed, so the
+        // Jacobi scaling is not available)
+        void set_data(const Eigen::VectorXd& b, const Eigen::VectorXd& P_k, double rho);
 
         // function to set cost function
         void set_cost(Eigen::SparseMatrix<double> Q, Eigen::VectorXd q){
             Q_ = Q; q_ = q;
         }
 
-        void resize_rotation_vector(const int length) {
-            rotation_matrices.resize(length);
-            rotation_matrices_trans.resize(length);
+        // allocates one friction cone rotation per cone (initialized to identity)
+        void resize_rotations(int n_cones) {
+            rotations_.resize(3, 3*n_cones);
+            for (int i = 0; i < n_cones; ++i) {
+                rotations_.block<3,3>(0, 3*i).setIdentity();
+            }
+            use_rotations_ = false;
         };
 
+        // sets the rotation of cone i (its z axis is the surface normal)
+        void set_rotation(int i, const Eigen::Matrix3d& R) {
+            rotations_.block<3,3>(0, 3*i) = R;
+            use_rotations_ = true;
+        }
+
         //Compute cost function for given x
-        double compute_obj(Eigen::VectorXd x_k);
+        double compute_obj(const Eigen::VectorXd& x);
+        //Compute change in cost from y_k to y_k_1 (needs gradient at y_k and y_diff)
         double compute_obj_diff();
 
         //Compute gradient of cost function for a given x
         void compute_grad_obj();
 
-        // warm starting x
-        void set_warm_x(Eigen::VectorXd x_wm){x_k = x_wm;}
+        // Hx = hessian of the cost function times x
+        void apply_hessian(const Eigen::VectorXd& x, Eigen::VectorXd& Hx);
+
+        // upper bound of the largest eigen value of the (scaled) hessian, infinity for the
+        // matrix free problems (ATA_ is not formed)
+        double hessian_bound() const;
+
+        // warm starting x, written into the existing buffer (a wrong size is rejected, x_k
+        // is returned as a view to python and must not be reallocated)
+        void set_warm_x(const Eigen::Ref<const Eigen::VectorXd>& x_wm);
+
+        // Use the block structured operator for A when its pattern allows it
+        // (falls back to the sparse matrices otherwise)
+        void set_block_operator(bool use_block_op) { use_block_op_ = use_block_op; }
+
+        // momentum scheme used by FISTA for this problem
+        void set_acceleration(Acceleration acceleration) { acceleration_ = acceleration; }
+
+        // Diagonal (Jacobi) scaling of the variables computed from the diagonal of ATA_.
+        // Variables in a block of block_size share one scale, so that second order 
+        // cones on them are unchanged by the scaling
+        void set_scaling(bool use_scaling, int block_size) { 
+            use_scaling_ = use_scaling; scaling_block_ = block_size;
+        }
 
         int num_vars_; //Total number of variables to optimize over
         int state_ = 0; //Number of State Variables
@@ -43,14 +102,29 @@ class ProblemData
         double rho_;
         double obj_ = 0.0;
 
+        Acceleration acceleration_ = Acceleration::nesterov;
+        int iters_ = 0; //FISTA iterations of the last solve
+        int restarts_ = 0; //momentum restarts of the last solve
+        int line_search_iters_ = 0; //backtracking trials of the last solve
+
         Eigen::VectorXd lb_;
         Eigen::VectorXd ub_;
 
+        bool use_scaling_ = false;
+        int scaling_block_ = 1;
+        // squared scale of each variable (x = D*z with D^2 = diag(scaling_))
+        Eigen::VectorXd scaling_;
+
         Eigen::VectorXd lb_rotated_;
         Eigen::VectorXd ub_rotated_;
 
-        std::vector<Eigen::Matrix3d> rotation_matrices;
-        std::vector<Eigen::Matrix3d> rotation_matrices_trans;
+        // rotations of the friction cones, stored contiguously as 3x3 blocks
+        // (one per end effector and knot), only used if use_rotations_ is set
+        Eigen::Matrix3Xd rotations_;
+        bool use_rotations_ = false;
+        // the friction cones are capped at the normal force ub_[3*i + 2] and the tangential
+        // forces are clamped to lb_ and ub_, only used if use_force_limits_ is set
+        bool use_force_limits_ = false;
 
         Eigen::VectorXd P_k_; //Dynamic Violation
 
@@ -61,6 +135,7 @@ class ProblemData
         Eigen::VectorXd b_;
         Eigen::VectorXd bPk_;
         Eigen::VectorXd ATbPk_;
+        BlockRowOperator A_op_;
 
         //FISTA related optimization variables
         Eigen::VectorXd y_k;
@@ -74,6 +149,47 @@ class ProblemData
         double G_k_norm;
         double G_k_norm_inf_max = 0.0;
         double G_k_norm_inf_min = 0.0;
+
+    private:
+        // symbolic phase : computes the sparsity pattern of ATA_ and the value
+        // index pairs of A_ that contribute to each of its non zeros
+        void analyze_pattern();
+        // numeric phase : refills the values of ATA_ in place
+        void update_hessian();
+        // computes scaling_ from the diagonal of ATA_
+        void update_scaling();
+        // checks if the sparsity pattern of A_ and Q_ is the one ATA_ was built for
+        bool pattern_changed() const;
+        // Ax = A_*x using the operator or the block operator if available
+        void apply_A(const Eigen::VectorXd& x, Eigen::VectorXd& Ax);
+        // x = A_^T*y, only used if ATA_ is not
+        void apply_AT(const Eigen::VectorXd& y, Eigen::VectorXd& x);
+        // true if the block operator is used for the current A_
+        bool block_op_active() const { return use_block_op_ && block_op_ready_; }
+        // true if the products with A_ are computed without ATA_
+        bool product_form() const { return matrix_free_ || block_op_active(); }
+
+        bool pattern_ready_ = false;
+        bool use_block_op_ = true;
+        bool block_op_ready_ = false;
+        // set by the matrix free set_data, A_ is not used then
+        bool matrix_free_ = false;
+        Operator op_apply_;
+        Operator op_apply_transpose_;
+        // scratch vectors for products with A_
+        Eigen::VectorXd Ay_k_;
+        Eigen::VectorXd Ax_;
+        Eigen::VectorXd Ay_diff_;
+        Eigen::VectorXd Qy_diff_;
+        // sparsity pattern of A_ and Q_ used to build ATA_
+        std::vector<int> A_outer_, A_inner_, Q_outer_, Q_inner_;
+        // for non zero k of ATA_, the products A_[ata_lhs_[s]]*A_[ata_rhs_[s]]
+        // with ata_ptr_[k] <= s < ata_ptr_[k+1] sum up to (A_^T A_)[k]
+        std::vector<int> ata_ptr_, ata_lhs_, ata_rhs_;
+        // index of the value of Q_ that contributes to non zero k of ATA_ (-1 if none)
+        std::vector<int> ata_q_idx_;
+        // index of the diagonal entries in the values of ATA_ (-1 if not stored)
+        std::vector<int> ata_diag_idx_;
     };
 } //namespace function
 
@@ -1,4 +1,5 @@
 #include "dynamics/centroidal.hpp"
+#include "logging/logging.hpp"
 
 
 namespace dynamics{
@@ -11,74 +12,132 @@ namespace dynamics{
             A_f.resize(9*(n_col_+1), 9*(n_col_+1));
             b_f.resize(9*(n_col_+1));
             b_f.setZero();
+            std::vector<Eigen::Triplet<double>> triplets;
             for (unsigned t = 0; t < n_col_; ++t){
-                for (unsigned l = 0; l < 3; ++l){
+                for (unsigned l = 0; l < 9; ++l){
                     // creating identities
-                    A_f.coeffRef(9*t+l,9*t+l) = 1.0;
-                    A_f.coeffRef(9*t+l,9*(t+1)+l) = -1.0;
+                    triplets.push_back(Eigen::Triplet<double>(9*t+l, 9*t+l, 1.0));
+                    triplets.push_back(Eigen::Triplet<double>(9*t+l, 9*(t+1)+l, -1.0));
                 }
-                for (unsigned l = 3; l < 9; ++l){
-                    // creating identities
-                    A_f.coeffRef(9*t+l,9*t+l) = 1.0;
-                    A_f.coeffRef(9*t+l,9*(t+1)+l) = -1.0;
+                // entries filled by compute_f_mat
+                for (auto& rc : f_mat_entries(t)){
+                    triplets.push_back(Eigen::Triplet<double>(rc.first, rc.second, 0.0));
                 }
             }
+            // initial state (filled by update_x_init)
+            for (unsigned l = 0; l < 9; ++l){
+                triplets.push_back(Eigen::Triplet<double>(9*n_col_+l, l, 0.0));
+            }
+            A_f.setFromTriplets(triplets.begin(), triplets.end());
+            A_f.makeCompressed();
 
             // setting up A_x, b_x (For optimizing for forces and torques)
             A_x.resize(9*(n_col_+1), 3*n_eff_*n_col_);
             b_x.resize(9*(n_col_+1));
             b_x.setZero();
+            triplets.clear();
+            for (unsigned t = 0; t < n_col_; ++t){
+                for (unsigned n = 0; n < n_eff_; ++n){
+                    for (auto& rc : x_mat_entries(t, n)){
+                        triplets.push_back(Eigen::Triplet<double>(rc.first, rc.second, 0.0));
+                    }
+                }
+            }
+            A_x.setFromTriplets(triplets.begin(), triplets.end());
+            A_x.makeCompressed();
+
+            // the patterns are fixed, so the time varying coefficients are written 
+            // directly into the value arrays at these offsets
+            for (unsigned t = 0; t < n_col_; ++t){
+                for (auto& rc : f_mat_entries(t)){
+                    f_val_idx_.push_back(&A_f.coeffRef(rc.first, rc.second) - A_f.valuePtr());
+                }
+                for (unsigned n = 0; n < n_eff_; ++n){
+                    for (auto& rc : x_mat_entries(t, n)){
+                        x_val_idx_.push_back(&A_x.coeffRef(rc.first, rc.second) - A_x.valuePtr());
+                    }
+                }
+            }
 
             cnt_arr_.resize(n_col_, n_eff_);
             cnt_arr_.setZero();
+            cnt_dt_.setZero(n_col_, n_eff_);
 
-            r_t.resize(n_eff_, 3);
-            r_t.setZero();
+            r_.setZero(n_col_*n_eff_, 3);
     };
 
-    void CentroidalDynamics::set_contact_arrays(Eigen::MatrixXd cnt_plan, double dt){
-        r_.push_back(r_t);
-        int i = r_.size() -1 ;
+    void CentroidalDynamics::set_contact_arrays(const Eigen::Ref<const Eigen::MatrixXd>& cnt_plan, double dt){
+        if (next_knot_ >= n_col_){
+            BICONVEX_LOG(logging::Level::error, "contact plan already set for all the knots");
+            return;
+        }
+        int i = next_knot_++;
         for (unsigned j = 0; j < n_eff_; ++j) {
             dt_[i] = dt;
             cnt_arr_(i, j) = cnt_plan(j, 0);
-            r_[i](j, 0) = cnt_plan(j, 1);
-            r_[i](j, 1) = cnt_plan(j, 2);
-            r_[i](j, 2) = cnt_plan(j, 3);
+            set_contact_location(i, j, cnt_plan.block<1,3>(j, 1).transpose());
+        }
+        cnt_dt_.row(i) = cnt_arr_.row(i)*dt;
+    };
+
+    void CentroidalDynamics::set_contact_plan(const Eigen::Ref<const ContactPlan>& cnt_plan, 
+                                              const Eigen::Ref<const Eigen::VectorXd>& dt){
+        dt_ = dt;
+        // same row layout as r_
+        r_ = cnt_plan.rightCols<3>();
+        for (unsigned i = 0; i < n_col_; ++i){
+            for (unsigned j = 0; j < n_eff_; ++j){
+                cnt_arr_(i, j) = cnt_plan(r_row(i, j), 0);
+            }
         }
+        cnt_dt_ = dt_.asDiagonal()*cnt_arr_;
     };
 
     void CentroidalDynamics::update_contact_array(){
         for (unsigned int i = 0; i < n_col_; ++i) {
             cnt_arr_.row(i) = cnt_arr_.row(i+1);
         }
+        cnt_dt_ = dt_.asDiagonal()*cnt_arr_;
     }
 
+    std::array<std::pair<int, int>, 9> CentroidalDynamics::x_mat_entries(int t, int n) const {
+        const int c = 3*n_eff_*t + 3*n;
+        return {{ {9*t+3, c}, {9*t+4, c+1}, {9*t+5, c+2},       // velocity
+                  {9*t+6, c+1}, {9*t+6, c+2}, {9*t+7, c+0},     // AMOM
+                  {9*t+7, c+2}, {9*t+8, c+0}, {9*t+8, c+1} }};
+    };
+
+    std::array<std::pair<int, int>, 9> CentroidalDynamics::f_mat_entries(int t) const {
+        return {{ {9*t+0, 9*(t+1)+3}, {9*t+1, 9*(t+1)+4}, {9*t+2, 9*(t+1)+5},    // CoM
+                  {9*t+6, 9*t+1}, {9*t+6, 9*t+2}, {9*t+7, 9*t+0},              // AMOM
+                  {9*t+7, 9*t+2}, {9*t+8, 9*t+0}, {9*t+8, 9*t+1} }};
+    };
+
     void CentroidalDynamics::compute_x_mat(Eigen::VectorXd &X){
 
-        for (unsigned t = 0; t < n_col_; ++t){
-            b_x[9*t+3] = X[9*(t+1)+3] - X[9*t+3];
-            b_x[9*t+4] = X[9*(t+1)+4] - X[9*t+4];
-            b_x[9*t+5] = X[9*(t+1)+5] - X[9*t+5] + 9.81*dt_[t];
-            b_x[9*t+6] = (X[9*(t+1)+6] - X[9*t+6]); 
-            b_x[9*t+7] = (X[9*(t+1)+7] - X[9*t+7]);
-            b_x[9*t+8] = (X[9*(t+1)+8] - X[9*t+8]);
+        compute_b_x(X);
 
-            for (unsigned n = 0; n < n_eff_; ++n){
+        double* a_x = A_x.valuePtr();
+        const int* idx = x_val_idx_.data();
+
+        for (unsigned t = 0; t < n_col_; ++t){
+            for (unsigned n = 0; n < n_eff_; ++n, idx += 9){
+                const Eigen::Vector3d r = r_.row(r_row(t,n));
+                const double c = cnt_dt_(t,n);
                 // velocity constraints
-                A_x.coeffRef(9*t+3, 3*n_eff_*t + 3*n) = cnt_arr_(t,n)*(dt_[t]); // normalized forces
-                A_x.coeffRef(9*t+4, 3*n_eff_*t + 3*n + 1) = cnt_arr_(t,n)*(dt_[t]);
-                A_x.coeffRef(9*t+5, 3*n_eff_*t + 3*n + 2) = cnt_arr_(t,n)*(dt_[t]);
+                a_x[idx[0]] = c; // normalized forces
+                a_x[idx[1]] = c;
+                a_x[idx[2]] = c;
 
                 // AMOM constraints
-                A_x.coeffRef(9*t+6, 3*n_eff_*t+3*n+1) = cnt_arr_(t,n)*(X((9*t)+2) - r_[t](n,2))*dt_[t];
-                A_x.coeffRef(9*t+6, 3*n_eff_*t+3*n+2) = -cnt_arr_(t,n)*(X((9*t)+1) - r_[t](n,1))*dt_[t];
+                a_x[idx[3]] = c*(X((9*t)+2) - r[2]);
+                a_x[idx[4]] = -c*(X((9*t)+1) - r[1]);
 
-                A_x.coeffRef(9*t+7, 3*n_eff_*t+3*n+0) = -cnt_arr_(t,n)*(X((9*t)+2) - r_[t](n,2))*dt_[t];
-                A_x.coeffRef(9*t+7, 3*n_eff_*t+3*n+2) = cnt_arr_(t,n)*(X((9*t)+0) - r_[t](n,0))*dt_[t];
+                a_x[idx[5]] = -c*(X((9*t)+2) - r[2]);
+                a_x[idx[6]] = c*(X((9*t)+0) - r[0]);
 
-                A_x.coeffRef(9*t+8, 3*n_eff_*t+3*n+0) = cnt_arr_(t,n)*(X((9*t)+1) - r_[t](n,1))*dt_[t];
-                A_x.coeffRef(9*t+8, 3*n_eff_*t+3*n+1) = -cnt_arr_(t,n)*(X((9*t)+0) - r_[t](n,0))*dt_[t];
+                a_x[idx[7]] = c*(X((9*t)+1) - r[1]);
+                a_x[idx[8]] = -c*(X((9*t)+0) - r[0]);
             }
         }
     };
@@ -86,45 +145,146 @@ namespace dynamics{
     void CentroidalDynamics::compute_f_mat(Eigen::VectorXd &F){
 
         // auto F = F1*m_; // de normalizing the F vector
+        compute_b_f(F);
+
+        double* a_f = A_f.valuePtr();
         for (unsigned t = 0; t < n_col_; ++t){
-            A_f.coeffRef(9*t+0,9*(t+1)+(0+3)) = dt_[t];
-            A_f.coeffRef(9*t+1,9*(t+1)+(1+3)) = dt_[t];
-            A_f.coeffRef(9*t+2,9*(t+1)+(2+3)) = dt_[t];
+            const int* idx = &f_val_idx_[9*t];
+            a_f[idx[0]] = dt_[t];
+            a_f[idx[1]] = dt_[t];
+            a_f[idx[2]] = dt_[t];
 
-            A_f.coeffRef(9*t+6, 9*t+1) = -cnt_arr_(t,0)*F[3*t*n_eff_+2]*dt_[t];
-            A_f.coeffRef(9*t+6, 9*t+2) = cnt_arr_(t,0)*F[3*t*n_eff_+1]*dt_[t];
-            
-            A_f.coeffRef(9*t+7, 9*t+0) = cnt_arr_(t,0)*F[3*t*n_eff_+2]*dt_[t];
-            A_f.coeffRef(9*t+7, 9*t+2) = -cnt_arr_(t,0)*F[3*t*n_eff_+0]*dt_[t];
+            // AMOM coefficients summed over the end effectors
+            double a_61 = -cnt_dt_(t,0)*F[3*t*n_eff_+2];
+            double a_62 = cnt_dt_(t,0)*F[3*t*n_eff_+1];
             
-            A_f.coeffRef(9*t+8, 9*t+0) = -cnt_arr_(t,0)*F[3*t*n_eff_+1]*dt_[t];
-            A_f.coeffRef(9*t+8, 9*t+1) = cnt_arr_(t,0)*F[3*t*n_eff_+0]*dt_[t];
+            double a_70 = cnt_dt_(t,0)*F[3*t*n_eff_+2];
+            double a_72 = -cnt_dt_(t,0)*F[3*t*n_eff_+0];
             
-            b_f[9*t+3] = -cnt_arr_(t,0)*F[3*t*n_eff_+0]*dt_[t];
-            b_f[9*t+4] = -cnt_arr_(t,0)*F[3*t*n_eff_+1]*dt_[t];
-            b_f[9*t+5] = -cnt_arr_(t,0)*F[3*t*n_eff_+2]*dt_[t] + 9.81*dt_[t];
-            b_f[9*t+6] = (cnt_arr_(t,0)*F[3*t*n_eff_+1]*r_[t](0,2) - cnt_arr_(t,0)*F[3*t*n_eff_+2]*r_[t](0,1))*dt_[t];
-            b_f[9*t+7] = (cnt_arr_(t,0)*F[3*t*n_eff_+2]*r_[t](0,0) - cnt_arr_(t,0)*F[3*t*n_eff_+0]*r_[t](0,2))*dt_[t];
-            b_f[9*t+8] = (cnt_arr_(t,0)*F[3*t*n_eff_+0]*r_[t](0,1) - cnt_arr_(t,0)*F[3*t*n_eff_+1]*r_[t](0,0))*dt_[t];
+            double a_80 = -cnt_dt_(t,0)*F[3*t*n_eff_+1];
+            double a_81 = cnt_dt_(t,0)*F[3*t*n_eff_+0];
             
             for (unsigned n = 1; n < n_eff_; ++n){
-                A_f.coeffRef(9*t+6, 9*t+1) += -cnt_arr_(t,n)*F[3*t*n_eff_+3*n+2]*dt_[t];
-                A_f.coeffRef(9*t+6, 9*t+2) += cnt_arr_(t,n)*F[3*t*n_eff_+3*n+1]*dt_[t];
+                a_61 += -cnt_dt_(t,n)*F[3*t*n_eff_+3*n+2];
+                a_62 += cnt_dt_(t,n)*F[3*t*n_eff_+3*n+1];
                 
-                A_f.coeffRef(9*t+7, 9*t+0) += cnt_arr_(t,n)*F[3*t*n_eff_+3*n+2]*dt_[t];
-                A_f.coeffRef(9*t+7, 9*t+2) += -cnt_arr_(t,n)*F[3*t*n_eff_+3*n+0]*dt_[t];
+                a_70 += cnt_dt_(t,n)*F[3*t*n_eff_+3*n+2];
+                a_72 += -cnt_dt_(t,n)*F[3*t*n_eff_+3*n+0];
                 
-                A_f.coeffRef(9*t+8, 9*t+0) += -cnt_arr_(t,n)*F[3*t*n_eff_+3*n+1]*dt_[t];
-                A_f.coeffRef(9*t+8, 9*t+1) += cnt_arr_(t,n)*F[3*t*n_eff_+3*n+0]*dt_[t];
-                
-                b_f[9*t+3] += -cnt_arr_(t,n)*F[3*t*n_eff_+3*n+0]*dt_[t];
-                b_f[9*t+4] += -cnt_arr_(t,n)*F[3*t*n_eff_+3*n+1]*dt_[t];
-                b_f[9*t+5] += -cnt_arr_(t,n)*F[3*t*n_eff_+3*n+2]*dt_[t];
-                b_f[9*t+6] += (cnt_arr_(t,n)*F[3*t*n_eff_+3*n+1]*r_[t](n,2) - cnt_arr_(t,n)*F[3*t*n_eff_+3*n+2]*r_[t](n,1))*dt_[t];
-                b_f[9*t+7] += (cnt_arr_(t,n)*F[3*t*n_eff_+3*n+2]*r_[t](n,0) - cnt_arr_(t,n)*F[3*t*n_eff_+3*n+0]*r_[t](n,2))*dt_[t];
-                b_f[9*t+8] += (cnt_arr_(t,n)*F[3*t*n_eff_+3*n+0]*r_[t](n,1) - cnt_arr_(t,n)*F[3*t*n_eff_+3*n+1]*r_[t](n,0))*dt_[t];
+                a_80 += -cnt_dt_(t,n)*F[3*t*n_eff_+3*n+1];
+                a_81 += cnt_dt_(t,n)*F[3*t*n_eff_+3*n+0];
+            }
+
+            a_f[idx[3]] = a_61;
+            a_f[idx[4]] = a_62;
+            a_f[idx[5]] = a_70;
+            a_f[idx[6]] = a_72;
+            a_f[idx[7]] = a_80;
+            a_f[idx[8]] = a_81;
+        }
+    };
+
+    void CentroidalDynamics::compute_b_x(const Eigen::VectorXd &X){
+        for (unsigned t = 0; t < n_col_; ++t){
+            b_x[9*t+3] = X[9*(t+1)+3] - X[9*t+3];
+            b_x[9*t+4] = X[9*(t+1)+4] - X[9*t+4];
+            b_x[9*t+5] = X[9*(t+1)+5] - X[9*t+5] + 9.81*dt_[t];
+            b_x[9*t+6] = (X[9*(t+1)+6] - X[9*t+6]); 
+            b_x[9*t+7] = (X[9*(t+1)+7] - X[9*t+7]);
+            b_x[9*t+8] = (X[9*(t+1)+8] - X[9*t+8]);
+        }
+    };
+
+    void CentroidalDynamics::compute_b_f(const Eigen::VectorXd &F){
+        for (unsigned t = 0; t < n_col_; ++t){
+            Eigen::Vector3d r = r_.row(r_row(t,0));
+            b_f[9*t+3] = -cnt_dt_(t,0)*F[3*t*n_eff_+0];
+            b_f[9*t+4] = -cnt_dt_(t,0)*F[3*t*n_eff_+1];
+            b_f[9*t+5] = -cnt_dt_(t,0)*F[3*t*n_eff_+2] + 9.81*dt_[t];
+            b_f[9*t+6] = cnt_dt_(t,0)*(F[3*t*n_eff_+1]*r[2] - F[3*t*n_eff_+2]*r[1]);
+            b_f[9*t+7] = cnt_dt_(t,0)*(F[3*t*n_eff_+2]*r[0] - F[3*t*n_eff_+0]*r[2]);
+            b_f[9*t+8] = cnt_dt_(t,0)*(F[3*t*n_eff_+0]*r[1] - F[3*t*n_eff_+1]*r[0]);
+
+            for (unsigned n = 1; n < n_eff_; ++n){
+                r = r_.row(r_row(t,n));
+                b_f[9*t+3] += -cnt_dt_(t,n)*F[3*t*n_eff_+3*n+0];
+                b_f[9*t+4] += -cnt_dt_(t,n)*F[3*t*n_eff_+3*n+1];
+                b_f[9*t+5] += -cnt_dt_(t,n)*F[3*t*n_eff_+3*n+2];
+                b_f[9*t+6] += cnt_dt_(t,n)*(F[3*t*n_eff_+3*n+1]*r[2] - F[3*t*n_eff_+3*n+2]*r[1]);
+                b_f[9*t+7] += cnt_dt_(t,n)*(F[3*t*n_eff_+3*n+2]*r[0] - F[3*t*n_eff_+3*n+0]*r[2]);
+                b_f[9*t+8] += cnt_dt_(t,n)*(F[3*t*n_eff_+3*n+0]*r[1] - F[3*t*n_eff_+3*n+1]*r[0]);
             }
         }
     };
 
+    void CentroidalDynamics::apply_x_mat(const Eigen::VectorXd &X, const Eigen::VectorXd &F, 
+                                         Eigen::VectorXd &y) const {
+        // velocity rows : sum of the forces, AMOM rows : sum of f x (com - r)
+        y.setZero(9*(n_col_+1));
+        for (unsigned t = 0; t < n_col_; ++t){
+            const Eigen::Vector3d com = X.segment<3>(9*t);
+            Eigen::Vector3d f_sum = Eigen::Vector3d::Zero();
+            Eigen::Vector3d tau_sum = Eigen::Vector3d::Zero();
+            for (unsigned n = 0; n < n_eff_; ++n){
+                if (cnt_dt_(t,n) == 0){
+                    continue;
+                }
+                const Eigen::Vector3d f = cnt_dt_(t,n)*F.segment<3>(3*n_eff_*t + 3*n);
+                f_sum += f;
+                tau_sum += f.cross(com - r_.row(r_row(t,n)).transpose());
+            }
+            y.segment<3>(9*t+3) = f_sum;
+            y.segment<3>(9*t+6) = tau_sum;
+        }
+    };
+
+    void CentroidalDynamics::apply_x_mat_transpose(const Eigen::VectorXd &X, const Eigen::VectorXd &r, 
+                                                   Eigen::VectorXd &g) const {
+        // (f x d).r_amom = f.(d x r_amom)
+        g.resize(3*n_eff_*n_col_);
+        for (unsigned t = 0; t < n_col_; ++t){
+            const Eigen::Vector3d com = X.segment<3>(9*t);
+            const Eigen::Vector3d r_vel = r.segment<3>(9*t+3);
+            const Eigen::Vector3d r_amom = r.segment<3>(9*t+6);
+            for (unsigned n = 0; n < n_eff_; ++n){
+                const Eigen::Vector3d d = com - r_.row(r_row(t,n)).transpose();
+                g.segment<3>(3*n_eff_*t + 3*n) = cnt_dt_(t,n)*(r_vel + d.cross(r_amom));
+            }
+        }
+    };
+
+    void CentroidalDynamics::apply_f_mat(const Eigen::VectorXd &F, const Eigen::VectorXd &X, 
+                                         Eigen::VectorXd &y) const {
+        // integration rows, AMOM rows get (dt * sum of the forces) x com in addition
+        y.resize(9*(n_col_+1));
+        for (unsigned t = 0; t < n_col_; ++t){
+            y.segment<9>(9*t) = X.segment<9>(9*t) - X.segment<9>(9*(t+1));
+            y.segment<3>(9*t) += dt_[t]*X.segment<3>(9*(t+1)+3);
+            y.segment<3>(9*t+6) += force_sum(F, t).cross(X.segment<3>(9*t));
+        }
+        // initial state rows (see update_x_init)
+        y.tail<9>() = X.head<9>();
+    };
+
+    void CentroidalDynamics::apply_f_mat_transpose(const Eigen::VectorXd &F, const Eigen::VectorXd &r, 
+                                                   Eigen::VectorXd &g) const {
+        // (S x com).r_amom = com.(r_amom x S)
+        g.setZero(9*(n_col_+1));
+        for (unsigned t = 0; t < n_col_; ++t){
+            g.segment<9>(9*t) += r.segment<9>(9*t);
+            g.segment<9>(9*(t+1)) -= r.segment<9>(9*t);
+            g.segment<3>(9*(t+1)+3) += dt_[t]*r.segment<3>(9*t);
+            g.segment<3>(9*t) += r.segment<3>(9*t+6).cross(force_sum(F, t));
+        }
+        g.head<9>() += r.tail<9>();
+    };
+
+    Eigen::Vector3d CentroidalDynamics::force_sum(const Eigen::VectorXd &F, int t) const {
+        Eigen::Vector3d f_sum = Eigen::Vector3d::Zero();
+        for (unsigned n = 0; n < n_eff_; ++n){
+            f_sum += cnt_dt_(t,n)*F.segment<3>(3*n_eff_*t + 3*n);
+        }
+        return f_sum;
+    };
+
 }
\ No newline at end of file
@@ -120,6 +120,28 @@ namespace gait_planner
         return phase_percent;
     }
 
+    Eigen::MatrixXi QuadrupedGait::get_phase_table(Eigen::VectorXd time)
+    {
+        Eigen::MatrixXi phase_table(time.size(), n_eff);
+        for (unsigned int i = 0; i < time.size(); ++i) {
+            for (int j = 0; j < n_eff; ++j) {
+                phase_table(i, j) = get_phase(time[i], j);
+            }
+        }
+        return phase_table;
+    }
+
+    Eigen::MatrixXd QuadrupedGait::get_percent_in_phase_table(Eigen::VectorXd time)
+    {
+        Eigen::MatrixXd percent_table(time.size(), n_eff);
+        for (unsigned int i = 0; i < time.size(); ++i) {
+            for (int j = 0; j < n_eff; ++j) {
+                percent_table(i, j) = get_percent_in_phase(time[i], j);
+            }
+        }
+        return percent_table;
+    }
+
     void QuadrupedGait::set_stance_percent(double lf_stance_percent, double lh_stance_percent, double rf_stance_percent,
                                            double rh_stance_percent)
     {
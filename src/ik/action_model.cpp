@@ -1,4 +1,5 @@
 #include "ik/action_model.hpp"
+#include "logging/logging.hpp"
 
 #include <pinocchio/algorithm/frames.hpp>
 #include <pinocchio/algorithm/kinematics.hpp>
@@ -23,8 +24,9 @@ namespace crocoddyl{
             B_lin(state->get_nv(), state->get_nv())
             {
                 if (costs_->get_nu() != nu_) {
-                    std::cout << "Invalid argument (from action model): Costs doesn't have the same control dimension. It should be - " 
-                            << nu_ << std::endl;
+                    BICONVEX_LOG(logging::Level::error, 
+                        "Invalid argument (from action model): Costs doesn't have the same control dimension. It should be - %d", 
+                        static_cast<int>(nu_));
                 }      
 
                 A_lin.setZero();
@@ -45,11 +47,11 @@ namespace crocoddyl{
                                 const Eigen::Ref<const VectorXs>& u){
 
         if (static_cast<std::size_t>(x.size()) != state_->get_nx()) {
-            std::cout << "Dimenstion of state incorrect (from action model) " << std::endl;
+            BICONVEX_LOG(logging::Level::error, "Dimenstion of state incorrect (from action model) ");
         }
     
         if (static_cast<std::size_t>(u.size()) != nu_) {
-            std::cout << "Dimenstion of action incorrect (from action model)" << std::endl;
+            BICONVEX_LOG(logging::Level::error, "Dimenstion of action incorrect (from action model)");
         }
         
         Data* d = static_cast<Data*>(data.get());
@@ -1,6 +1,7 @@
 // This file contains end effector tracking tasks
 
 #include "ik/inverse_kinematics.hpp"
+#include "logging/logging.hpp"
 
 
 namespace ik{
@@ -64,7 +65,7 @@ namespace ik{
                     pinocchio::FrameIndex fid, int st, int et, 
                     Eigen::MatrixXd traj, double wt, std::string cost_name){
 
-        std::cout << "function not implemented" << std::endl;
+        BICONVEX_LOG(logging::Level::error, "function not implemented");
         // for (unsigned i = sn; i < en; ++i){
         //     crocoddyl::FrameMotion Mref(fid, pinocchio::Motion(traj.row(i - sn)));
         //     boost::shared_ptr<crocoddyl::CostModelAbstract> vel_tracking_cost =
@@ -51,11 +51,29 @@ namespace ik{
 
     };
 
-    void InverseKinematics::optimize(const Eigen::VectorXd& x0){
+    void InverseKinematics::optimize(const Eigen::VectorXd& x0, double time_limit_us){
         
         problem_ = boost::make_shared<crocoddyl::ShootingProblem>(x0, rint_arr_, tint_model_);
         ddp_ = boost::make_shared<crocoddyl::SolverDDP>(problem_);
-        ddp_->solve();
+        time_limit_reached_ = false;
+        if (time_limit_us > 0){
+            const auto deadline = std::chrono::steady_clock::now() + 
+                                  std::chrono::duration<double, std::micro>(time_limit_us);
+            // one iteration per solve, continued from the iterate and the regularization
+            // of the previous one
+            bool converged = ddp_->solve(crocoddyl::DEFAULT_VECTOR, crocoddyl::DEFAULT_VECTOR, 1);
+            for (int i = 1; i < max_iters_ && !converged; ++i){
+                if (std::chrono::steady_clock::now() > deadline){
+                    time_limit_reached_ = true;
+                    break;
+                }
+                converged = ddp_->solve(ddp_->get_xs(), ddp_->get_us(), 1, 
+                                        ddp_->get_is_feasible(), ddp_->get_xreg());
+            }
+        }
+        else {
+            ddp_->solve();
+        }
 
 
         // wonder how effecient this ?
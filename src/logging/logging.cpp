@@ -0,0 +1,86 @@
+#include "logging/logging.hpp"
+
+#include <cstdarg>
+#include <cstdio>
+
+
+namespace logging{
+
+    Logger::Logger(std::size_t capacity){
+        std::size_t size = 1;
+        while (size < capacity){
+            size <<= 1;
+        }
+        slots_.reset(new Slot[size]);
+        mask_ = size - 1;
+        for (std::size_t i = 0; i < size; ++i){
+            slots_[i].seq.store(i, std::memory_order_relaxed);
+        }
+        t0_ = std::chrono::steady_clock::now();
+    };
+
+    void Logger::log(Level level, const char* format, ...){
+        // bounded multi producer queue : a slot can be written at position pos if its
+        // sequence number is pos, and can be read once it is pos + 1
+        std::size_t pos = write_pos_.load(std::memory_order_relaxed);
+        Slot* slot;
+        while (true){
+            slot = &slots_[pos & mask_];
+            std::size_t seq = slot->seq.load(std::memory_order_acquire);
+            if (seq == pos){
+                if (write_pos_.compare_exchange_weak(pos, pos + 1, std::memory_order_relaxed)){
+                    break;
+                }
+            }
+            else if (seq < pos){
+                // buffer is full
+                dropped_.fetch_add(1, std::memory_order_relaxed);
+                return;
+            }
+            else {
+                pos = write_pos_.load(std::memory_order_relaxed);
+            }
+        }
+
+        std::chrono::duration<double> t = std::chrono::steady_clock::now() - t0_;
+        slot->level = level;
+        slot->time = t.count();
+        va_list args;
+        va_start(args, format);
+        std::vsnprintf(slot->text, message_size_, format, args);
+        va_end(args);
+        slot->seq.store(pos + 1, std::memory_order_release);
+    };
+
+    std::vector<Message> Logger::drain(){
+        std::vector<Message> messages;
+        std::size_t pos = read_pos_.load(std::memory_order_relaxed);
+        while (true){
+            Slot& slot = slots_[pos & mask_];
+            if (slot.seq.load(std::memory_order_acquire) != pos + 1){
+                break;
+            }
+            messages.push_back({slot.level, slot.time, slot.text});
+            // the slot can be written again one round later
+            slot.seq.store(pos + mask_ + 1, std::memory_order_release);
+            ++pos;
+        }
+        read_pos_.store(pos, std::memory_order_relaxed);
+        return messages;
+    };
+
+    void Logger::flush(std::ostream& os){
+        static const char* names[] = {"DEBUG", "INFO", "WARNING", "ERROR"};
+        for (const Message& message : drain()){
+            os << "[" << names[static_cast<int>(message.level)] << " " << message.time << "] "
+               << message.text << "\n";
+        }
+        os.flush();
+    };
+
+    Logger& logger(){
+        static Logger logger(1024);
+        return logger;
+    };
+
+}
@@ -0,0 +1,46 @@
+#include "motion_planner/batch.hpp"
+
+#include <algorithm>
+#include <atomic>
+#include <thread>
+
+
+namespace motion_planner{
+
+    void optimize_batch(const std::vector<BiConvexMP*>& problems, 
+                        const std::vector<Eigen::VectorXd>& x_init, int num_iters, int n_threads){
+        if (problems.size() != x_init.size()){
+            BICONVEX_LOG(logging::Level::error, "batch sizes do not match. Expected one x_init per problem ...");
+            return;
+        }
+        // a planner in the batch twice would be solved by two threads at the same time
+        std::vector<BiConvexMP*> sorted(problems);
+        std::sort(sorted.begin(), sorted.end());
+        if (std::adjacent_find(sorted.begin(), sorted.end()) != sorted.end()){
+            BICONVEX_LOG(logging::Level::error, "batch has the same problem twice. Expected distinct problems ...");
+            return;
+        }
+        if (n_threads <= 0){
+            n_threads = std::max(1u, std::thread::hardware_concurrency());
+        }
+        n_threads = std::min<int>(n_threads, problems.size());
+
+        // every thread takes the next problem that is not solved yet
+        std::atomic<std::size_t> next{0};
+        auto worker = [&](){
+            for (std::size_t i = next++; i < problems.size(); i = next++){
+                problems[i]->optimize(x_init[i], num_iters);
+            }
+        };
+
+        std::vector<std::thread> threads;
+        for (int i = 1; i < n_threads; ++i){
+            threads.emplace_back(worker);
+        }
+        worker();
+        for (std::thread& thread : threads){
+            thread.join();
+        }
+    };
+
+}
@@ -1,4 +1,5 @@
 # include "motion_planner/biconvex.hpp"
+#include <algorithm>
 
 
 namespace motion_planner{
@@ -6,15 +7,18 @@ namespace motion_planner{
     BiConvexMP::BiConvexMP(double m, int n_col, int n_eff):
         m_(m), n_eff_(n_eff), n_col_(n_col), centroidal_dynamics(m, n_col, n_eff),
         prob_data_x(9, n_col+1), prob_data_f(3*n_eff, n_col),
-        fista_x(), fista_f(){
+        fista_x(), fista_f(), prob_data_fc_(3, n_col*n_eff){
     
-            com_opt_.resize(n_col_ + 1, 3); com_opt_.setZero();
             mom_opt_.resize(n_col_ + 1, 6); mom_opt_.setZero();
         
             dyn_violation.resize(9*(n_col_+1));
             dyn_violation.setZero();
             P_k_.resize(9*(n_col_+1));
             P_k_.setZero();
+            fista_iters_.setZero(2);
+            f_max_.setConstant(std::numeric_limits<double>::quiet_NaN());
+            // friction coefficient default of fista
+            mu_.setConstant(n_col_*n_eff_, 1.0);
 
             // setting starting line search params
             fista_x.set_l0(2.25e6);
@@ -24,42 +28,202 @@ namespace motion_planner{
 
             //Use Second Order Cone Projection
             fista_f.set_soc_true();
+            prob_data_f.resize_rotations(n_col_*n_eff_);
     };
 
+    void BiConvexMP::set_contact_normals(Eigen::MatrixXd normals){
+        if (normals.rows() != n_col_*n_eff_ || normals.cols() != 3){
+            BICONVEX_LOG(logging::Level::error, "contact normals wrong size. Expected (n_col*n_eff) x 3 ...");
+            return;
+        }
+        prob_data_f.resize_rotations(n_col_*n_eff_);
+        for (unsigned i = 0; i < normals.rows(); ++i){
+            Eigen::Vector3d normal = normals.row(i).transpose();
+            // flat ground does not need a rotation
+            if (normal.normalized().isApprox(Eigen::Vector3d::UnitZ())){
+                continue;
+            }
+            prob_data_f.set_rotation(i, 
+                    Eigen::Quaterniond::FromTwoVectors(Eigen::Vector3d::UnitZ(), normal).toRotationMatrix());
+        }
+    }
+
     void BiConvexMP::create_bound_constraints(Eigen::MatrixXd b, double fx_max, double fy_max, double fz_max){
         
-        prob_data_x.lb_ = -1*std::numeric_limits<double>::infinity()*Eigen::VectorXd::Ones(prob_data_x.lb_.size());        
-        prob_data_x.ub_ = std::numeric_limits<double>::infinity()*Eigen::VectorXd::Ones(prob_data_x.lb_.size());        
+        prob_data_x.lb_.setConstant(-std::numeric_limits<double>::infinity());
+        prob_data_x.ub_.setConstant(std::numeric_limits<double>::infinity());
         
         // TODO: Throw errors here
         if (b.cols() != 6){
-            std::cout << "bound constraints wrong size. Expected 6 ..." << std::endl;
+            BICONVEX_LOG(logging::Level::error, "bound constraints wrong size. Expected 6 ...");
+        }
+
+        // force limits only have to be written again if they changed
+        if (f_max_ != Eigen::Vector3d(fx_max, fy_max, fz_max)){
+            // keeps the enforcement chosen with set_force_limits (off by default)
+            set_force_limits(Eigen::RowVector3d(fx_max, fy_max, fz_max).replicate(n_col_*n_eff_, 1),
+                             prob_data_f.use_force_limits_);
+            f_max_ << fx_max, fy_max, fz_max;
         }
                 
         for (unsigned i = 0; i < centroidal_dynamics.cnt_arr_.rows(); ++i){
-            // this can be done once and never done again
-            for(unsigned j = 0; j < n_eff_; ++j){
-                prob_data_f.lb_[3*n_eff_*i + j*3] = -fx_max;
-                prob_data_f.lb_[3*n_eff_*i+ j*3 + 1] = -fy_max;
-                prob_data_f.lb_[3*n_eff_*i+ j*3 + 2] = 0;
-
-                prob_data_f.ub_[3*n_eff_*i + j*3] = fx_max;
-                prob_data_f.ub_[3*n_eff_*i+ j*3 + 1] = fy_max;
-                prob_data_f.ub_[3*n_eff_*i+ j*3 + 2] = fz_max;                    
-            }
             if (centroidal_dynamics.cnt_arr_.row(i).sum() > 0){
-                prob_data_x.lb_[9*i] = centroidal_dynamics.r_[i].col(0).maxCoeff() + b(i,0);                 
-                prob_data_x.lb_[9*i+1] = centroidal_dynamics.r_[i].col(1).maxCoeff() + b(i,1);                 
-                prob_data_x.lb_[9*i+2] = centroidal_dynamics.r_[i].col(2).maxCoeff() + b(i,2);
+                // contact locations of the end effectors at knot i
+                const auto r_i = centroidal_dynamics.r_.middleRows(n_eff_*i, n_eff_);
+                prob_data_x.lb_[9*i] = r_i.col(0).maxCoeff() + b(i,0);                 
+                prob_data_x.lb_[9*i+1] = r_i.col(1).maxCoeff() + b(i,1);                 
+                prob_data_x.lb_[9*i+2] = r_i.col(2).maxCoeff() + b(i,2);
 
-                prob_data_x.ub_[9*i] = centroidal_dynamics.r_[i].col(0).minCoeff() + b(i,3);                 
-                prob_data_x.ub_[9*i+1] = centroidal_dynamics.r_[i].col(1).minCoeff() + b(i,4);                 
-                prob_data_x.ub_[9*i+2] = centroidal_dynamics.r_[i].col(2).minCoeff() + b(i,5);
+                prob_data_x.ub_[9*i] = r_i.col(0).minCoeff() + b(i,3);                 
+                prob_data_x.ub_[9*i+1] = r_i.col(1).minCoeff() + b(i,4);                 
+                prob_data_x.ub_[9*i+2] = r_i.col(2).minCoeff() + b(i,5);
             }
         };
     };
 
-    void BiConvexMP::create_cost_X(Eigen::VectorXd W_X, Eigen::VectorXd W_X_ter, Eigen::VectorXd X_ter, Eigen::VectorXd X_nom){
+    void BiConvexMP::set_contact_plan_horizon(const Eigen::Ref<const dynamics::CentroidalDynamics::ContactPlan>& cnt_plan, 
+                                              const Eigen::Ref<const Eigen::VectorXd>& dt){
+        if (cnt_plan.rows() != n_col_*n_eff_ || dt.size() != n_col_){
+            BICONVEX_LOG(logging::Level::error, "contact plan wrong size. Expected (n_col*n_eff) x 4 and n_col time steps ...");
+            return;
+        }
+        centroidal_dynamics.set_contact_plan(cnt_plan, dt);
+    };
+
+    void BiConvexMP::set_contact_location(int t, int n, const Eigen::Vector3d& r){
+        if (t < 0 || t >= n_col_ || n < 0 || n >= n_eff_){
+            BICONVEX_LOG(logging::Level::error, "contact location index out of range. Expected t < n_col and n < n_eff ...");
+            return;
+        }
+        centroidal_dynamics.set_contact_location(t, n, r);
+    };
+
+    void BiConvexMP::set_rotation_matrix_f(int t, int n, Eigen::Matrix3d rot_matrix){
+        if (t < 0 || t >= n_col_ || n < 0 || n >= n_eff_){
+            BICONVEX_LOG(logging::Level::error, "rotation matrix index out of range. Expected t < n_col and n < n_eff ...");
+            return;
+        }
+        prob_data_f.set_rotation(n_eff_*t + n, rot_matrix);
+    };
+
+    void BiConvexMP::set_warm_start_vars(const Eigen::Ref<const Eigen::VectorXd>& x_wm, 
+                                         const Eigen::Ref<const Eigen::VectorXd>& f_wm, 
+                                         const Eigen::Ref<const Eigen::VectorXd>& P_wm){
+        if (x_wm.size() != 9*(n_col_+1) || f_wm.size() != 3*n_eff_*n_col_ || P_wm.size() != P_k_.size()){
+            BICONVEX_LOG(logging::Level::error, "warm start wrong size. Expected 9*(n_col+1), 3*n_eff*n_col and 9*(n_col+1) ...");
+            return;
+        }
+        prob_data_x.set_warm_x(x_wm);
+        prob_data_f.set_warm_x(f_wm);
+        P_k_.noalias() = P_wm;
+    };
+
+    void BiConvexMP::set_force_limits(Eigen::MatrixXd f_max, bool enforce){
+        if (f_max.rows() != n_col_*n_eff_ || f_max.cols() != 3){
+            BICONVEX_LOG(logging::Level::error, "force limits wrong size. Expected (n_col*n_eff) x 3 ...");
+            return;
+        }
+        // bounds as 3 x (n_col*n_eff) arrays, one column per end effector and knot
+        Eigen::Map<Eigen::Matrix3Xd> lb(prob_data_f.lb_.data(), 3, n_col_*n_eff_);
+        Eigen::Map<Eigen::Matrix3Xd> ub(prob_data_f.ub_.data(), 3, n_col_*n_eff_);
+        ub = f_max.transpose();
+        lb.topRows(2) = -ub.topRows(2);
+        lb.row(2).setZero();
+        prob_data_f.use_force_limits_ = enforce;
+        // limits are not known to be uniform
+        f_max_.setConstant(std::numeric_limits<double>::quiet_NaN());
+    }
+
+    void BiConvexMP::set_friction_coefficients(Eigen::VectorXd mu){
+        if (mu.size() != n_col_*n_eff_){
+            BICONVEX_LOG(logging::Level::error, "friction coefficients wrong size. Expected n_col*n_eff ...");
+            return;
+        }
+        mu_ = mu;
+        fista_f.set_friction_coefficients(mu_);
+    }
+
+    void BiConvexMP::update_bounds_f(Eigen::MatrixXd f_max_fin){
+        // shifts the force limits by one knot and sets the ones of the last knot
+        const int n_fin = 3*n_eff_;
+        const int n = prob_data_f.num_vars_ - n_fin;
+        std::copy(prob_data_f.lb_.data() + n_fin, prob_data_f.lb_.data() + n_fin + n, prob_data_f.lb_.data());
+        std::copy(prob_data_f.ub_.data() + n_fin, prob_data_f.ub_.data() + n_fin + n, prob_data_f.ub_.data());
+
+        Eigen::Map<Eigen::Matrix3Xd> lb(prob_data_f.lb_.data() + n, 3, n_eff_);
+        Eigen::Map<Eigen::Matrix3Xd> ub(prob_data_f.ub_.data() + n, 3, n_eff_);
+        ub = f_max_fin.transpose();
+        lb.topRows(2) = -ub.topRows(2);
+        lb.row(2).setZero();
+        // limits are no longer uniform
+        f_max_.setConstant(std::numeric_limits<double>::quiet_NaN());
+    }
+
+    void BiConvexMP::update_friction_coefficients(Eigen::VectorXd mu_fin){
+        if (mu_fin.size() != n_eff_){
+            BICONVEX_LOG(logging::Level::error, "friction coefficients wrong size. Expected n_eff ...");
+            return;
+        }
+        // shifts the friction coefficients by one knot and sets the ones of the last knot
+        std::copy(mu_.data() + n_eff_, mu_.data() + mu_.size(), mu_.data());
+        mu_.tail(n_eff_) = mu_fin;
+        fista_f.set_friction_coefficients(mu_);
+    }
+
+    void BiConvexMP::update_cost_x(Eigen::VectorXd X_ter, Eigen::VectorXd X_ter_nrml){
+        // shifts the running cost by one knot, the last running knot tracks X_ter_nrml
+        const int n = prob_data_x.num_vars_ - 18;
+        for (unsigned i = 0; i < n; ++i){
+            prob_data_x.Q_.coeffRef(i,i) = prob_data_x.Q_.coeffRef(i+9,i+9);
+        }
+        std::copy(prob_data_x.q_.data() + 9, prob_data_x.q_.data() + 9 + n, prob_data_x.q_.data());
+        
+        for (unsigned i = 0; i < 9; ++i){
+            prob_data_x.q_[n+i] = -2*X_ter_nrml[i]*prob_data_x.Q_.coeffRef(n+i,n+i);
+            prob_data_x.q_[n+9+i] = -2*X_ter[i]*prob_data_x.Q_.coeffRef(n+9+i,n+9+i);
+        }
+    };
+
+    void BiConvexMP::update_bounds_x(Eigen::VectorXd lb_fin, Eigen::VectorXd ub_fin){
+        // shifts the state bounds by one knot and sets the ones of the last knot
+        const int n = prob_data_x.num_vars_ - 9;
+        std::copy(prob_data_x.lb_.data() + 9, prob_data_x.lb_.data() + 9 + n, prob_data_x.lb_.data());
+        std::copy(prob_data_x.ub_.data() + 9, prob_data_x.ub_.data() + 9 + n, prob_data_x.ub_.data());
+        prob_data_x.lb_.tail(9) = lb_fin;
+        prob_data_x.ub_.tail(9) = ub_fin;
+    };
+
+    void BiConvexMP::shift_horizon(int n_knots){
+        if (n_knots < 0 || n_knots >= n_col_){
+            BICONVEX_LOG(logging::Level::error, "shift out of range. Expected 0 <= n_knots < n_col ...");
+            return;
+        }
+        // states : knot t takes knot t + n_knots, the final knots are extrapolated
+        Eigen::VectorXd& X = prob_data_x.x_k;
+        std::copy(X.data() + 9*n_knots, X.data() + 9*(n_col_+1), X.data());
+        for (int t = n_col_ + 1 - n_knots; t <= n_col_; ++t){
+            X.segment<9>(9*t) = X.segment<9>(9*(t-1));
+            X.segment<3>(9*t) += centroidal_dynamics.dt_[n_col_-1]*X.segment<3>(9*t+3);
+        }
+
+        // forces : the final knot is held (optimize sets the forces of the end effectors
+        // that are not in contact in the new plan to zero). The forces stay in newtons like 
+        // the solution returned by return_opt_f
+        Eigen::VectorXd& F = prob_data_f.x_k;
+        const int n_f = 3*n_eff_;
+        std::copy(F.data() + n_f*n_knots, F.data() + n_f*n_col_, F.data());
+        for (int t = n_col_ - n_knots; t < n_col_; ++t){
+            F.segment(n_f*t, n_f) = F.segment(n_f*(n_col_-n_knots-1), n_f);
+        }
+
+        // dual : rows 9*t to 9*t+8 are the dynamics between knot t and t+1, the last
+        // 9 rows are the initial state constraint and stay in place
+        std::copy(P_k_.data() + 9*n_knots, P_k_.data() + 9*n_col_, P_k_.data());
+        P_k_.segment(9*(n_col_-n_knots), 9*n_knots).setZero();
+    };
+
+    void BiConvexMP::create_cost_X(const Eigen::Ref<const Eigen::VectorXd>& W_X, const Eigen::Ref<const Eigen::VectorXd>& W_X_ter, 
+                                   const Eigen::Ref<const Eigen::VectorXd>& X_ter, const Eigen::Ref<const Eigen::VectorXd>& X_nom){
 
         for (unsigned i = 0; i < prob_data_x.num_vars_ - 9; ++i){
             prob_data_x.Q_.coeffRef(i,i) = W_X[i];
@@ -73,78 +237,405 @@ namespace motion_planner{
 
     };
 
-    void BiConvexMP::create_cost_F(Eigen::VectorXd W_F){
+    void BiConvexMP::create_cost_F(const Eigen::Ref<const Eigen::VectorXd>& W_F){
         for (unsigned i = 0; i < prob_data_f.num_vars_; ++i){
             prob_data_f.Q_.coeffRef(i,i) = W_F[i];
         }
     }
 
-    void BiConvexMP::optimize(Eigen::VectorXd x_init, int num_iters){
+    void BiConvexMP::optimize(Eigen::VectorXd x_init, int num_iters, double time_limit_us){
+        // the subproblems stop at the deadline, an outer iteration that reaches it is still
+        // completed (with one FISTA iteration) so that its dynamic violation is known
+        const bool use_time_limit = time_limit_us > 0;
+        const auto deadline = std::chrono::steady_clock::now() + 
+                    std::chrono::microseconds(static_cast<long>(time_limit_us));
+        if (use_time_limit){
+            fista_x.set_deadline(deadline);
+            fista_f.set_deadline(deadline);
+        }
+        else{
+            fista_x.clear_deadline();
+            fista_f.clear_deadline();
+        }
+        status_ = Status::max_iters;
+        residual_ = std::numeric_limits<double>::infinity();
+
         // updating x_init
         centroidal_dynamics.update_x_init(x_init);
+        if (use_adaptive_rho_ && !keep_rho_ && rho_ != rho_init_){
+            // the rho adapted to the previous problem is not kept
+            scale_rho(rho_init_/rho_);
+        }
+        fista_iters_.setZero();
+        n_telemetry_ = 0;
+        dyn_violation_hist_.clear();
+        std::chrono::steady_clock::time_point t0, t1, t2;
+        // the dual residual is only needed by the adaptive rho and the dual exit criteria
+        const bool use_dual_res = use_adaptive_rho_ || 
+                                  dual_exit_tol_ < std::numeric_limits<double>::infinity();
+        // the Jacobi scaling and the fixed step need the assembled hessians, so the matrices
+        // are assembled then
+        matrix_free_ = use_matrix_free_ && !use_fixed_step_ && 
+                       !prob_data_x.use_scaling_ && !prob_data_f.use_scaling_;
+        // forces of end effectors that are not in contact only decay through the (small)
+        // force cost, so the warm start sets them to zero. The compressed problem does not 
+        // have them, so both start from the same forces
+        Eigen::Map<Eigen::Matrix3Xd> F_eff(prob_data_f.x_k.data(), 3, n_col_*n_eff_);
+        for (unsigned t = 0; t < n_col_; ++t){
+            F_eff.middleCols(n_eff_*t, n_eff_) *= centroidal_dynamics.cnt_arr_.row(t).asDiagonal();
+        }
+        // the f subproblem is solved on prob_f, the solution is kept in prob_data_f
+        if (compress_forces_){
+            compress_f_problem();
+        }
+        function::ProblemData& prob_f = compress_forces_ ? prob_data_fc_ : prob_data_f;
+        if (matrix_free_){
+            // the products use the X (F) that stays fixed while F (X) is optimized
+            if (compress_forces_){
+                prob_data_fc_.set_operator(
+                    [this](const Eigen::VectorXd& F, Eigen::VectorXd& y){
+                        scatter_f(F, f_full_);
+                        centroidal_dynamics.apply_x_mat(prob_data_x.x_k, f_full_, y); },
+                    [this](const Eigen::VectorXd& r, Eigen::VectorXd& g){
+                        centroidal_dynamics.apply_x_mat_transpose(prob_data_x.x_k, r, f_full_);
+                        gather_f(f_full_, g); });
+            }
+            else {
+                prob_data_f.set_operator(
+                    [this](const Eigen::VectorXd& F, Eigen::VectorXd& y){
+                        centroidal_dynamics.apply_x_mat(prob_data_x.x_k, F, y); },
+                    [this](const Eigen::VectorXd& r, Eigen::VectorXd& g){
+                        centroidal_dynamics.apply_x_mat_transpose(prob_data_x.x_k, r, g); });
+            }
+            prob_data_x.set_operator(
+                [this](const Eigen::VectorXd& X, Eigen::VectorXd& y){
+                    centroidal_dynamics.apply_f_mat(prob_data_f.x_k, X, y); },
+                [this](const Eigen::VectorXd& r, Eigen::VectorXd& g){
+                    centroidal_dynamics.apply_f_mat_transpose(prob_data_f.x_k, r, g); });
+        }
         // std::cout << prob_data_f.x_k << std::endl;
         for (unsigned i = 0; i < num_iters; ++i){
             // We need to look into this line...it causes a very high dynamic violation...
             //maxit = init_maxit/(int(i)/10 + 1);
 
+            // inexact subproblems : the FISTA tolerance follows the last dynamic violation
+            // (the one of the previous optimize call in the first iteration)
+            double tol_k = std::max(tol, inexact_factor_*dyn_violation.norm());
+
+            const bool record = n_telemetry_ < telemetry_.rows();
+            if (record){
+                t0 = std::chrono::steady_clock::now();
+            }
+
             // std::cout << "optimizing F" << std::endl;
             // optimizing for F
             // std::cout << prob_data_f.x_k.norm() << std::endl;
-            centroidal_dynamics.compute_x_mat(prob_data_x.x_k);
-            prob_data_f.set_data(centroidal_dynamics.A_x, centroidal_dynamics.b_x, P_k_, rho_);
-            fista_f.optimize(prob_data_f, maxit, tol);
+            if (matrix_free_){
+                centroidal_dynamics.compute_b_x(prob_data_x.x_k);
+                prob_f.set_data(centroidal_dynamics.b_x, P_k_, rho_);
+            }
+            else if (compress_forces_){
+                centroidal_dynamics.compute_x_mat(prob_data_x.x_k);
+                compress_x_mat();
+                prob_f.set_data(A_xc_, centroidal_dynamics.b_x, P_k_, rho_);
+            }
+            else {
+                centroidal_dynamics.compute_x_mat(prob_data_x.x_k);
+                prob_f.set_data(centroidal_dynamics.A_x, centroidal_dynamics.b_x, P_k_, rho_);
+            }
+            fista_f.optimize(prob_f, maxit, tol_k);
+            fista_iters_[1] += prob_f.iters_;
+            if (compress_forces_){
+                scatter_f(prob_data_fc_.x_k, prob_data_f.x_k);
+            }
+            if (record){
+                t1 = std::chrono::steady_clock::now();
+            }
 
             // std::cout << "optimizing X" << std::endl;
             // optimizing for X
             // std::cout << prob_data_x.x_k.norm() << std::endl;
-            centroidal_dynamics.compute_f_mat(prob_data_f.x_k);
-            prob_data_x.set_data(centroidal_dynamics.A_f, centroidal_dynamics.b_f, P_k_, rho_);
-            fista_x.optimize(prob_data_x, maxit, tol);
+            if (matrix_free_){
+                centroidal_dynamics.compute_b_f(prob_data_f.x_k);
+                prob_data_x.set_data(centroidal_dynamics.b_f, P_k_, rho_);
+            }
+            else {
+                centroidal_dynamics.compute_f_mat(prob_data_f.x_k);
+                prob_data_x.set_data(centroidal_dynamics.A_f, centroidal_dynamics.b_f, P_k_, rho_);
+            }
+            if (use_dual_res){
+                x_prev_ = prob_data_x.x_k;
+            }
+            fista_x.optimize(prob_data_x, maxit, tol_k);
+            fista_iters_[0] += prob_data_x.iters_;
+            if (record){
+                t2 = std::chrono::steady_clock::now();
+            }
             
-            dyn_violation = centroidal_dynamics.A_f * prob_data_x.x_k - centroidal_dynamics.b_f;
+            if (matrix_free_){
+                centroidal_dynamics.apply_f_mat(prob_data_f.x_k, prob_data_x.x_k, dyn_violation);
+                dyn_violation -= centroidal_dynamics.b_f;
+            }
+            else {
+                dyn_violation = centroidal_dynamics.A_f * prob_data_x.x_k - centroidal_dynamics.b_f;
+            }
             P_k_ += dyn_violation;
+            if (use_dual_res){
+                x_diff_ = prob_data_x.x_k - x_prev_;
+                if (matrix_free_){
+                    centroidal_dynamics.apply_f_mat(prob_data_f.x_k, x_diff_, dyn_violation_diff_);
+                    // A_x is the one of X before the x optimization
+                    centroidal_dynamics.apply_x_mat_transpose(x_prev_, dyn_violation_diff_, dual_res_);
+                }
+                else {
+                    dyn_violation_diff_.noalias() = centroidal_dynamics.A_f*x_diff_;
+                    dual_res_.noalias() = centroidal_dynamics.A_x.transpose()*dyn_violation_diff_;
+                }
+            }
             // std::cout << dyn_violation.norm() << std::endl;
             //Keep track of any statistics that may be useful
             if (log_statistics) {
                 dyn_violation_hist_.push_back(dyn_violation.norm());
             };
+            if (record){
+                auto row = telemetry_.row(n_telemetry_++);
+                row[time_f] = std::chrono::duration<double>(t1 - t0).count();
+                row[time_x] = std::chrono::duration<double>(t2 - t1).count();
+                row[time_update] = std::chrono::duration<double>(std::chrono::steady_clock::now() - t2).count();
+                row[fista_iters_x] = prob_data_x.iters_;
+                row[fista_iters_f] = prob_f.iters_;
+                row[step_x] = fista_x.get_l();
+                row[step_f] = fista_f.get_l();
+                row[line_search_x] = prob_data_x.line_search_iters_;
+                row[line_search_f] = prob_f.line_search_iters_;
+                row[obj_x] = prob_data_x.compute_obj(prob_data_x.x_k);
+                row[obj_f] = prob_f.compute_obj(prob_f.x_k);
+                row[primal_res] = dyn_violation.norm();
+                row[dual_res] = use_dual_res ? rho_*dual_res_.norm() : 
+                                               std::numeric_limits<double>::quiet_NaN();
+                row[rho] = rho_;
+            }
 
             if(std::isnan(dyn_violation.norm())){
-                std::cout << "ERROR: solver diverged, Dyn violation is NaN" << std::endl;
+                BICONVEX_LOG(logging::Level::error, "solver diverged, Dyn violation is NaN");
+                status_ = Status::diverged;
                 break;
             };
 
-            if (dyn_violation.norm() < exit_tol){
+            if (use_time_limit && dyn_violation.norm() < residual_){
+                x_best_ = prob_data_x.x_k;
+                f_best_ = prob_data_f.x_k;
+                p_best_ = P_k_;
+                rho_best_ = rho_;
+                residual_ = dyn_violation.norm();
+            }
+
+            if (dyn_violation.norm() < exit_tol && 
+                    (!use_dual_res || rho_*dual_res_.norm() < dual_exit_tol_)){
                 // std::cout << "breaking outer loop due to norm ..." << std::endl;
+                status_ = Status::converged;
                 break;
             };
 
+            if (use_time_limit && std::chrono::steady_clock::now() > deadline){
+                status_ = Status::time_limit;
+                break;
+            }
+
+            if (use_adaptive_rho_){
+                update_rho();
+            }
+
         }
     
-        centroidal_dynamics.r_.clear();
+        if (status_ == Status::time_limit){
+            // the dual of the best iterate (scaled by its rho) is the warm start of the next call
+            if (rho_ != rho_best_){
+                scale_rho(rho_best_/rho_);
+            }
+            prob_data_x.x_k = x_best_;
+            prob_data_f.x_k = f_best_;
+            P_k_ = p_best_;
+        }
+        else{
+            residual_ = dyn_violation.norm();
+        }
+
+        if (compress_forces_){
+            // fista_f has the friction coefficients of the compressed cones
+            fista_f.set_friction_coefficients(mu_);
+        }
+        centroidal_dynamics.restart_contact_plan();
         prob_data_f.x_k *= m_;
-        std::cout << "Maximum iterations reached " << std::endl << "Final norm: " << dyn_violation.norm() << std::endl;
+        BICONVEX_LOG(logging::Level::debug, "optimize finished with status %d, final norm : %g", 
+                     static_cast<int>(status_), residual_);
     }
 
-    Eigen::MatrixXd BiConvexMP::return_opt_com(){
-        for (unsigned i = 0; i < n_col_+1 ; ++i){
-            com_opt_(i,0) = prob_data_x.x_k[9*i];
-            com_opt_(i,1) = prob_data_x.x_k[9*i+1];
-            com_opt_(i,2) = prob_data_x.x_k[9*i+2];
-        };
-    
-        return com_opt_;
+    void BiConvexMP::compress_f_problem(){
+        const auto& cnt_arr = centroidal_dynamics.cnt_arr_;
+        f_active_.clear();
+        for (unsigned t = 0; t < n_col_; ++t){
+            for (unsigned n = 0; n < n_eff_; ++n){
+                if (cnt_arr(t,n) != 0){
+                    f_active_.push_back(n_eff_*t + n);
+                }
+            }
+        }
+        const int n_act = f_active_.size();
+        if (prob_data_fc_.horizon_ != n_act){
+            prob_data_fc_.resize(n_act);
+        }
+        gather_f(prob_data_f.x_k, prob_data_fc_.x_k);
+        gather_f(prob_data_f.lb_, prob_data_fc_.lb_);
+        gather_f(prob_data_f.ub_, prob_data_fc_.ub_);
+        prob_data_fc_.use_force_limits_ = prob_data_f.use_force_limits_;
+        gather_f(prob_data_f.q_, prob_data_fc_.q_);
+
+        // cost : entries of Q between forces in contact. Q_c is only built again if the
+        // contacts or the pattern of Q changed, its values are refilled otherwise
+        auto& Q_f = prob_data_f.Q_;
+        Q_f.makeCompressed();
+        const int* Q_outer = Q_f.outerIndexPtr(); const int* Q_inner = Q_f.innerIndexPtr();
+        if (f_active_ != q_c_active_ || q_f_outer_.size() != Q_f.outerSize() + 1 || 
+                q_f_inner_.size() != Q_f.nonZeros() ||
+                !std::equal(q_f_outer_.begin(), q_f_outer_.end(), Q_outer) ||
+                !std::equal(q_f_inner_.begin(), q_f_inner_.end(), Q_inner)){
+            std::vector<int> f_idx(prob_data_f.num_vars_, -1);
+            for (int j = 0; j < n_act; ++j){
+                for (int c = 0; c < 3; ++c){
+                    f_idx[3*f_active_[j] + c] = 3*j + c;
+                }
+            }
+            // f_idx is increasing, so the kept entries are in the same (column major) 
+            // order in Q_c as in Q
+            std::vector<Eigen::Triplet<double>> triplets;
+            triplets.reserve(Q_f.nonZeros());
+            q_c_idx_.assign(Q_f.nonZeros(), -1);
+            for (int k = 0; k < Q_f.outerSize(); ++k){
+                for (int p = Q_outer[k]; p < Q_outer[k+1]; ++p){
+                    if (f_idx[Q_inner[p]] >= 0 && f_idx[k] >= 0){
+                        q_c_idx_[p] = triplets.size();
+                        triplets.push_back(Eigen::Triplet<double>(f_idx[Q_inner[p]], f_idx[k], 0.0));
+                    }
+                }
+            }
+            prob_data_fc_.Q_.setFromTriplets(triplets.begin(), triplets.end());
+            prob_data_fc_.Q_.makeCompressed();
+            q_c_active_ = f_active_;
+            q_f_outer_.assign(Q_outer, Q_outer + Q_f.outerSize() + 1);
+            q_f_inner_.assign(Q_inner, Q_inner + Q_f.nonZeros());
+        }
+        const double* Q_val = Q_f.valuePtr();
+        double* Q_c_val = prob_data_fc_.Q_.valuePtr();
+        for (int p = 0; p < Q_f.nonZeros(); ++p){
+            if (q_c_idx_[p] >= 0){
+                Q_c_val[q_c_idx_[p]] = Q_val[p];
+            }
+        }
+
+        // friction cones
+        mu_c_.resize(n_act);
+        for (int j = 0; j < n_act; ++j){
+            mu_c_[j] = mu_[f_active_[j]];
+        }
+        fista_f.set_friction_coefficients(mu_c_);
+        if (prob_data_f.use_rotations_){
+            prob_data_fc_.resize_rotations(n_act);
+            for (int j = 0; j < n_act; ++j){
+                prob_data_fc_.set_rotation(j, prob_data_f.rotations_.block<3,3>(0, 3*f_active_[j]));
+            }
+        }
+        else {
+            prob_data_fc_.use_rotations_ = false;
+        }
+
+        prob_data_fc_.set_acceleration(prob_data_f.acceleration_);
+        prob_data_fc_.set_scaling(prob_data_f.use_scaling_, prob_data_f.scaling_block_);
+    }
+
+    void BiConvexMP::compress_x_mat(){
+        // A_x is column major, so the columns of the forces in contact are copied in order
+        const auto& A_x = centroidal_dynamics.A_x;
+        A_xc_.resize(A_x.rows(), 3*f_active_.size());
+        A_xc_.reserve(A_x.nonZeros());
+        for (int j = 0; j < f_active_.size(); ++j){
+            for (int c = 0; c < 3; ++c){
+                A_xc_.startVec(3*j + c);
+                for (Eigen::SparseMatrix<double>::InnerIterator it(A_x, 3*f_active_[j] + c); it; ++it){
+                    A_xc_.insertBack(it.row(), 3*j + c) = it.value();
+                }
+            }
+        }
+        A_xc_.finalize();
+    }
+
+    void BiConvexMP::gather_f(const Eigen::VectorXd& f, Eigen::VectorXd& f_c) const {
+        f_c.resize(3*f_active_.size());
+        for (int j = 0; j < f_active_.size(); ++j){
+            f_c.segment<3>(3*j) = f.segment<3>(3*f_active_[j]);
+        }
+    }
+
+    void BiConvexMP::scatter_f(const Eigen::VectorXd& f_c, Eigen::VectorXd& f) const {
+        f.setZero(3*n_col_*n_eff_);
+        for (int j = 0; j < f_active_.size(); ++j){
+            f.segment<3>(3*f_active_[j]) = f_c.segment<3>(3*j);
+        }
+    }
+
+    void BiConvexMP::update_rho(){
+        // primal residual : dynamic violation, dual residual : change of the optimality 
+        // condition of F through the x update. Both are relative (to the constraint terms 
+        // and to the gradient terms of F) since their magnitudes are not comparable otherwise.
+        // The dual residual is not relative to A_x^T*P_k : after the dual update it only 
+        // differs from A_x^T*A_f*(X - X_prev) by the (small) gradient of the force cost, 
+        // so the ratio stays close to one and rho would only decrease
+        if (matrix_free_){
+            // A_x is the one of X before the x optimization
+            centroidal_dynamics.apply_f_mat(prob_data_f.x_k, prob_data_x.x_k, A_f_x_);
+            centroidal_dynamics.apply_x_mat_transpose(x_prev_, A_f_x_, A_x_A_f_x_);
+        }
+        else {
+            A_f_x_.noalias() = centroidal_dynamics.A_f*prob_data_x.x_k;
+            A_x_A_f_x_.noalias() = centroidal_dynamics.A_x.transpose()*A_f_x_;
+        }
+        grad_f_.noalias() = prob_data_f.Q_*prob_data_f.x_k;
+        grad_f_ *= 2.0;
+        grad_f_ += prob_data_f.q_;
+        double r_prim = dyn_violation.norm()/
+                std::max(A_f_x_.norm(), centroidal_dynamics.b_f.norm());
+        double r_dual = dual_res_.norm()/
+                std::max(A_x_A_f_x_.norm(), grad_f_.norm()/rho_);
+        double scale = 1.0;
+        if (r_prim > rho_mu_*r_dual && rho_*rho_tau_ <= rho_max_){
+            scale = rho_tau_;
+        }
+        else if (r_dual > rho_mu_*r_prim && rho_/rho_tau_ >= rho_min_){
+            scale = 1.0/rho_tau_;
+        }
+        else {
+            return;
+        }
+        scale_rho(scale);
     };
 
-    Eigen::MatrixXd BiConvexMP::return_opt_mom(){
-        for (unsigned i = 0; i < n_col_ +1; ++i){
-            mom_opt_(i,0) =   m_*prob_data_x.x_k[9*i+3];
-            mom_opt_(i,1) = m_*prob_data_x.x_k[9*i+4];
-            mom_opt_(i,2) = m_*prob_data_x.x_k[9*i+5];
-            mom_opt_(i,3) = m_*prob_data_x.x_k[9*i+6]; // de normalizing the angular momentum
-            mom_opt_(i,4) = m_*prob_data_x.x_k[9*i+7]; // de normalizing the angular momentum
-            mom_opt_(i,5) = m_*prob_data_x.x_k[9*i+8]; // de normalizing the angular momentum
-        };
+    void BiConvexMP::scale_rho(double scale){
+        rho_ *= scale;
+        // P_k_ is the dual scaled by 1/rho
+        P_k_ /= scale;
+        // the hessians scale with rho (the Jacobi scaled ones have a unit diagonal)
+        if (!prob_data_x.use_scaling_){
+            fista_x.scale_l(scale);
+        }
+        if (!prob_data_f.use_scaling_){
+            fista_f.scale_l(scale);
+        }
+    };
+
+    const Eigen::MatrixXd& BiConvexMP::return_opt_mom(){
+        // linear and angular momentum of each knot (stored normalized by the mass in X)
+        mom_opt_ = m_*Eigen::Map<const Eigen::Matrix<double, Eigen::Dynamic, 6, Eigen::RowMajor>, 
+                                 0, Eigen::OuterStride<9>>(prob_data_x.x_k.data() + 3, n_col_ + 1, 6);
         return mom_opt_;
     };
 
@@ -5,7 +5,7 @@ namespace motion_planner{
     KinoDynMP::KinoDynMP(std::string urdf, double m, int n_eff, int dyn_col, int ik_col):
                 dyn_col_(dyn_col), ik_col_(ik_col), dyn(m, dyn_col, n_eff), ik(urdf, ik_col){
 
-        std::cout << "Initialized Kino-Dyn planner" << std::endl;
+        BICONVEX_LOG(logging::Level::info, "Initialized Kino-Dyn planner");
         pinocchio::urdf::buildModel(urdf,pinocchio::JointModelFreeFlyer(), rmodel_) ;
         pinocchio::Data rdata_tmp(rmodel_);
         rdata_ = rdata_tmp;
@@ -42,7 +42,8 @@ namespace motion_planner{
         wt_mom_.setZero(6);
     };
 
-    void KinoDynMP::optimize(Eigen::VectorXd q, Eigen::VectorXd v, int dyn_iters, int kino_dyn_iters){
+    void KinoDynMP::optimize(Eigen::VectorXd q, Eigen::VectorXd v, int dyn_iters, int kino_dyn_iters,
+                             double time_limit_us){
 
         const auto t1 = std::chrono::steady_clock::now();    
         pinocchio::computeCentroidalMomentum(rmodel_, rdata_, q, v);
@@ -50,8 +51,18 @@ namespace motion_planner{
         set_warm_starts();
 
         const auto t2 = std::chrono::steady_clock::now();    
-        dyn.optimize(X_wm.head(9), dyn_iters);
+        if (time_limit_us > 0){
+            // the dynamics get their share of what is left of the time limit (at least 1 
+            // micro second, since 0 disables it)
+            std::chrono::duration<double, std::micro> elapsed = t2 - t1;
+            dyn.optimize(X_wm.head(9), dyn_iters, 
+                         std::max((1.0 - ik_time_fraction_)*time_limit_us - elapsed.count(), 1.0));
+        }
+        else {
+            dyn.optimize(X_wm.head(9), dyn_iters);
+        }
         const auto t3 = std::chrono::steady_clock::now();    
+        status_ = dyn.return_status();
 
         dyn_com_opt = dyn.return_opt_com();
         dyn_mom_opt = dyn.return_opt_mom();
@@ -61,7 +72,17 @@ namespace motion_planner{
         ik.add_com_position_tracking_task(0, ik_col_, dyn_com_opt.topRows(ik_col_), wt_com_, "com_track", false);
         ik.add_com_position_tracking_task(0, ik_col_, dyn_com_opt.row(ik_col_), wt_com_, "com_track", true);
         const auto t4 = std::chrono::steady_clock::now();    
-        ik.optimize(x0);
+        if (time_limit_us > 0){
+            // the IK gets the time left until the deadline
+            std::chrono::duration<double, std::micro> elapsed = t4 - t1;
+            ik.optimize(x0, std::max(time_limit_us - elapsed.count(), 1.0));
+            if (ik.return_time_limit_reached()){
+                status_ = Status::time_limit;
+            }
+        }
+        else {
+            ik.optimize(x0);
+        }
         const auto t5 = std::chrono::steady_clock::now();    
         // Todo: add kino dyn iteration requirement later
         // ik.compute_optimal_com_and_mom(ik_com_opt, ik_mom_opt);
@@ -78,32 +99,38 @@ namespace motion_planner{
             solve_times[1] = kin_time.count();
             solve_times[2] = total_time.count();
 
-            std::cout << "Dyn optimize time : " << dyn_time.count() << std::endl; 
-            std::cout << "Kin optimize time : " << kin_time.count() << std::endl; 
-            std::cout << "Total optimize time : " << total_time.count() << std::endl; 
-            std::cout << "===============================================" << std::endl;
+            BICONVEX_LOG(logging::Level::info, "Dyn optimize time : %g, Kin optimize time : %g, Total optimize time : %g",
+                         dyn_time.count(), kin_time.count(), total_time.count());
         };
 
     }
 
     void KinoDynMP::set_warm_starts(){
 
-        // if(n == 0){
-        for (unsigned i = 0; i < X_wm.size()/9; ++i){
-            X_wm[9*i] = rdata_.com[0][0];
-            X_wm[9*i+1] = rdata_.com[0][1];
-            X_wm[9*i+2] = rdata_.com[0][2];
-            X_wm[9*i+3] = rdata_.vcom[0][0];
-            X_wm[9*i+4] = rdata_.vcom[0][1];
-            X_wm[9*i+5] = rdata_.vcom[0][2];
-
-            X_wm[9*i+6] = rdata_.hg.toVector()[3]/dyn.m_;
-            X_wm[9*i+7] = rdata_.hg.toVector()[4]/dyn.m_;
-            X_wm[9*i+8] = rdata_.hg.toVector()[5]/dyn.m_;
+        Eigen::VectorXd X0(9);
+        X0 << rdata_.com[0], rdata_.vcom[0], rdata_.hg.toVector().tail<3>()/dyn.m_;
+
+        if (use_shift_ && n > 0){
+            // previous solution moved shift_knots_ knots forward. The planner resets the origin
+            // every cycle, so the com trajectory is translated to start at the current com
+            dyn.shift_horizon(shift_knots_);
+            X_wm = dyn.return_opt_x();
+            Eigen::Vector3d offset = X0.head<3>() - X_wm.head<3>();
+            for (unsigned i = 0; i < X_wm.size()/9; ++i){
+                X_wm.segment<3>(9*i) += offset;
+            }
+            X_wm.head(9) = X0;
+            // the solver works with the forces divided by the mass
+            F_wm = dyn.return_opt_f()/dyn.m_;
+            P_wm = dyn.return_opt_p();
+        }
+        else{
+            for (unsigned i = 0; i < X_wm.size()/9; ++i){
+                X_wm.segment<9>(9*i) = X0;
+            }
+            F_wm.setZero();
+            P_wm.setZero();
         }
-        // for (unsigned i = 0; i < F_wm.size()/3; ++i){
-        //     F_wm[3*i] = 9.81;
-        // }
 
         dyn.set_warm_start_vars(X_wm, F_wm, P_wm);
     }
@@ -0,0 +1,84 @@
+#include "solvers/block_operator.hpp"
+
+#include <algorithm>
+
+namespace function
+{
+    bool BlockRowOperator::analyze_pattern(const Eigen::SparseMatrix<double>& A){
+        if (A.rows() % block_rows != 0 || A.cols() % block_cols != 0){
+            return false;
+        }
+        const int n_row_blocks = A.rows()/block_rows;
+        const int n_col_blocks = A.cols()/block_cols;
+        const int* outer = A.outerIndexPtr(); const int* inner = A.innerIndexPtr();
+
+        // index of the stored block at (row block, column block), -1 if empty
+        std::vector<int> block_idx(n_row_blocks*n_col_blocks, -1);
+        for (int c = 0; c < A.cols(); ++c){
+            for (int p = outer[c]; p < outer[c+1]; ++p){
+                block_idx[(inner[p]/block_rows)*n_col_blocks + c/block_cols] = 0;
+            }
+        }
+        int n_blocks = std::count(block_idx.begin(), block_idx.end(), 0);
+        // the blocks only pay off while they are not much larger than the 
+        // non zeros they hold
+        if (n_blocks*Block::SizeAtCompileTime > 4*A.nonZeros()){
+            return false;
+        }
+
+        rows_ = A.rows(); cols_ = A.cols();
+        block_ptr_.assign(n_row_blocks + 1, 0);
+        block_col_.resize(n_blocks);
+        int k = 0;
+        for (int b = 0; b < n_row_blocks; ++b){
+            for (int c = 0; c < n_col_blocks; ++c){
+                if (block_idx[b*n_col_blocks + c] == 0){
+                    block_idx[b*n_col_blocks + c] = k;
+                    block_col_[k] = block_cols*c;
+                    ++k;
+                }
+            }
+            block_ptr_[b+1] = k;
+        }
+        blocks_.assign(n_blocks, Block::Zero());
+
+        value_idx_.resize(A.nonZeros());
+        for (int c = 0; c < A.cols(); ++c){
+            for (int p = outer[c]; p < outer[c+1]; ++p){
+                int k = block_idx[(inner[p]/block_rows)*n_col_blocks + c/block_cols];
+                value_idx_[p] = Block::SizeAtCompileTime*k + block_rows*(c % block_cols) + inner[p] % block_rows;
+            }
+        }
+        return true;
+    }
+
+    void BlockRowOperator::set_values(const Eigen::SparseMatrix<double>& A){
+        const double* values = A.valuePtr();
+        double* block_values = blocks_.empty() ? nullptr : blocks_[0].data();
+        for (int p = 0; p < A.nonZeros(); ++p){
+            block_values[value_idx_[p]] = values[p];
+        }
+    }
+
+    void BlockRowOperator::apply(const Eigen::VectorXd& x, Eigen::VectorXd& y) const {
+        y.resize(rows_);
+        Eigen::Matrix<double, block_rows, 1> y_b;
+        for (unsigned b = 0; b + 1 < block_ptr_.size(); ++b){
+            y_b.setZero();
+            for (int k = block_ptr_[b]; k < block_ptr_[b+1]; ++k){
+                y_b.noalias() += blocks_[k]*x.segment<block_cols>(block_col_[k]);
+            }
+            y.segment<block_rows>(block_rows*b) = y_b;
+        }
+    }
+
+    void BlockRowOperator::apply_transpose(const Eigen::VectorXd& y, Eigen::VectorXd& x) const {
+        x.setZero(cols_);
+        for (unsigned b = 0; b + 1 < block_ptr_.size(); ++b){
+            for (int k = block_ptr_[b]; k < block_ptr_[b+1]; ++k){
+                x.segment<block_cols>(block_col_[k]).noalias() += blocks_[k].transpose()*y.segment<block_rows>(block_rows*b);
+            }
+        }
+    }
+
+} //namespace function
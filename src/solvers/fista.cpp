@@ -1,4 +1,7 @@
 #include "solvers/fista.hpp"
+#include "logging/logging.hpp"
+
+#include <limits>
 
 
 namespace solvers
@@ -6,17 +9,22 @@ namespace solvers
     void FISTA::compute_step_length(function::ProblemData & prob_data_) {
         prob_data_.compute_grad_obj();    
         while (1) {
+            gradient_step(prob_data_);
             if (!use_soc_projection_) {
-                prob_data_.y_k_1 = (prob_data_.y_k - prob_data_.gradient/L_).cwiseMin(prob_data_.ub_).cwiseMax(prob_data_.lb_);
+                prob_data_.y_k_1 = prob_data_.y_k_1.cwiseMin(prob_data_.ub_).cwiseMax(prob_data_.lb_);
             }
             else {
                 SoC_projection(prob_data_);
             }
             prob_data_.y_diff = (prob_data_.y_k_1 - prob_data_.y_k); // proximal gradient
             prob_data_.G_k_norm = prob_data_.y_diff.norm(); // proximal gradient norm
-            if (prob_data_.compute_obj_diff() > prob_data_.gradient.transpose()*(prob_data_.y_diff) +
-                                                                    (L_/2)*(prob_data_.G_k_norm*prob_data_.G_k_norm)){
+            // the fixed step is below 1/L (upper bound of the largest eigen value), so the
+            // sufficient decrease holds without checking it
+            if (!fixed_step_active_ && 
+                    prob_data_.compute_obj_diff() > prob_data_.gradient.transpose()*(prob_data_.y_diff) +
+                                                    (L_/2)*step_norm_sq(prob_data_)){
                 L_ = beta_*L_;
+                ++prob_data_.line_search_iters_;
                 // std::cout << "Line search called - " << L_ << std::endl;
             }
             else {
@@ -26,13 +34,58 @@ namespace solvers
         }
     }
 
+    void FISTA::gradient_step(function::ProblemData & prob_data_) {
+        if (prob_data_.use_scaling_) {
+            // gradient step on the scaled variables z = D^-1 x, mapped back to x
+            prob_data_.y_k_1 = prob_data_.y_k - prob_data_.scaling_.cwiseProduct(prob_data_.gradient)/L_;
+        }
+        else {
+            prob_data_.y_k_1 = prob_data_.y_k - prob_data_.gradient/L_;
+        }
+    }
+
+    double FISTA::step_norm_sq(function::ProblemData & prob_data_) {
+        if (prob_data_.use_scaling_) {
+            return prob_data_.y_diff.cwiseQuotient(prob_data_.scaling_).dot(prob_data_.y_diff);
+        }
+        return prob_data_.G_k_norm*prob_data_.G_k_norm;
+    }
+
     void FISTA::optimize(function::ProblemData & prob_data_, int max_iters, double tol){
         prob_data_.y_k = prob_data_.x_k;
+        // the matrix free problems have no hessian bound, they keep the line search
+        fixed_step_active_ = false;
+        if (use_fixed_step_) {
+            const double bound = prob_data_.hessian_bound();
+            if (bound < std::numeric_limits<double>::infinity()) {
+                L_ = bound;
+                fixed_step_active_ = true;
+            }
+        }
         t_k = 1.0;
+        prob_data_.iters_ = 0;
+        prob_data_.restarts_ = 0;
+        prob_data_.line_search_iters_ = 0;
+        if (prob_data_.acceleration_ == function::Acceleration::function_restart){
+            obj_k = prob_data_.compute_obj(prob_data_.x_k);
+        }
         for (int i=0; i<max_iters; ++i) {
             compute_step_length(prob_data_);
-            t_k_1 = 1.0 + sqrt(1 + 4*t_k*t_k)/2.0;
-            prob_data_.y_k_1 = prob_data_.x_k_1 + ((t_k-1)/t_k_1)*(prob_data_.x_k_1 - prob_data_.x_k);
+            ++prob_data_.iters_;
+            if (restart_momentum(prob_data_)) {
+                // drop the momentum and continue from the last proximal step
+                t_k_1 = 1.0;
+                prob_data_.y_k_1 = prob_data_.x_k_1;
+                ++prob_data_.restarts_;
+            }
+            else if (prob_data_.acceleration_ == function::Acceleration::greedy) {
+                t_k_1 = 1.0;
+                prob_data_.y_k_1 = prob_data_.x_k_1 + greedy_momentum_*(prob_data_.x_k_1 - prob_data_.x_k);
+            }
+            else {
+                t_k_1 = (1.0 + sqrt(1 + 4*t_k*t_k))/2.0;
+                prob_data_.y_k_1 = prob_data_.x_k_1 + ((t_k-1)/t_k_1)*(prob_data_.x_k_1 - prob_data_.x_k);
+            }
             
             prob_data_.x_k = prob_data_.x_k_1;
             // prob_data_.x_k.swap(prob_data_.x_k_1);
@@ -41,9 +94,12 @@ namespace solvers
                 break;
             }
             if(std::isnan(prob_data_.G_k_norm)){
-                std::cout << "ERROR: FISTA diverged, Dyn violation is NaN" << std::endl;
+                BICONVEX_LOG(logging::Level::error, "FISTA diverged, Dyn violation is NaN");
                 break;
             };
+            if (use_deadline_ && std::chrono::steady_clock::now() > deadline_){
+                break;
+            }
 
             // std::cout << prob_data_.G_k_norm << std::endl;
             // see if this step can be removed
@@ -55,22 +111,68 @@ namespace solvers
 
     }
 
+    bool FISTA::restart_momentum(function::ProblemData & prob_data_) {
+        switch (prob_data_.acceleration_) {
+            case function::Acceleration::gradient_restart:
+            case function::Acceleration::greedy:
+                // restart if the momentum points against the proximal gradient step
+                return (prob_data_.y_k - prob_data_.x_k_1).dot(prob_data_.x_k_1 - prob_data_.x_k) > 0;
+            case function::Acceleration::function_restart: {
+                // restart if the objective increased
+                double obj_k_1 = prob_data_.compute_obj(prob_data_.x_k_1);
+                bool restart = obj_k_1 > obj_k;
+                obj_k = obj_k_1;
+                return restart;
+            }
+            default:
+                return false;
+        }
+    }
+
     void FISTA::SoC_projection(function::ProblemData & prob_data_) {
-        prob_data_.y_k_1 = (prob_data_.y_k - prob_data_.gradient/L_);
+        // forces as 3 x n_cones array (one column per end effector and knot)
+        const int n_cones = prob_data_.num_vars_/3;
+        Eigen::Map<Eigen::Matrix3Xd> F(prob_data_.y_k_1.data(), 3, n_cones);
+        if (mu_arr_.size() != n_cones){
+            mu_arr_.setConstant(n_cones, mu_);
+        }
 
         //Projection happens in the local frame
-        for (unsigned int i=0; i < prob_data_.num_vars_; i+=3) {
-            //Eigen::Vector3d rotated_force = prob_data_.rotation_matrices[i]*prob_data_.y_k_1.segment(1,3);
-            //soc_norm = rotated_force.segment(0,2).squaredNorm();
-            soc_norm = prob_data_.y_k_1.segment(i,2).squaredNorm();
-            //auto z = rotated_force[2]
-            auto z = prob_data_.y_k_1[i + 2];
-            if (soc_norm*mu_ < -z || z < 0) {
-                prob_data_.y_k_1.segment(i,3) = Eigen::VectorXd::Zero(3);
-            } else if (soc_norm > mu_ * z) {
-                //Apply second order cone projection
-                prob_data_.y_k_1.segment(i,2) *= ((mu_ * mu_) * soc_norm + (mu_ * z)) / ( ((mu_ * mu_) + 1) * soc_norm);
-                prob_data_.y_k_1[i + 2] = (mu_ * soc_norm + z) / ((mu_ * mu_ )+ 1);
+        const bool rotated = prob_data_.use_rotations_;
+        if (rotated) {
+            for (int i = 0; i < n_cones; ++i) {
+                F.col(i) = prob_data_.rotations_.block<3,3>(0, 3*i).transpose()*F.col(i);
+            }
+        }
+
+        soc_norm_ = (F.row(0).array().square() + F.row(1).array().square()).sqrt();
+        // cone surface point closest to the force (clamped to the tip inside the polar cone)
+        soc_proj_ = ((mu_arr_*soc_norm_ + F.row(2).array())/(mu_arr_.square() + 1.0)).max(0.0);
+        // forces inside the cone are kept as they are
+        soc_inside_ = soc_norm_ <= mu_arr_*F.row(2).array();
+        soc_scale_ = soc_inside_.select(1.0, mu_arr_*soc_proj_/soc_norm_.max(1e-12));
+
+        F.row(2) = soc_inside_.select(F.row(2).array(), soc_proj_).matrix();
+        F.row(0).array() *= soc_scale_;
+        F.row(1).array() *= soc_scale_;
+
+        if (prob_data_.use_force_limits_) {
+            // capped cone : forces above the cap go to its disk of radius mu*fz_max
+            Eigen::Map<const Eigen::Matrix3Xd> lb(prob_data_.lb_.data(), 3, n_cones);
+            Eigen::Map<const Eigen::Matrix3Xd> ub(prob_data_.ub_.data(), 3, n_cones);
+            soc_norm_ *= soc_scale_;
+            soc_scale_ = (mu_arr_*ub.row(2).array()/soc_norm_.max(1e-12)).min(1.0);
+            F.row(2) = F.row(2).cwiseMin(ub.row(2));
+            F.row(0).array() *= soc_scale_;
+            F.row(1).array() *= soc_scale_;
+            // clamping the tangential forces keeps them inside the capped cone (it is the 
+            // exact projection only if the clamp is not active)
+            F.topRows(2) = F.topRows(2).cwiseMin(ub.topRows(2)).cwiseMax(lb.topRows(2));
+        }
+
+        if (rotated) {
+            for (int i = 0; i < n_cones; ++i) {
+                F.col(i) = prob_data_.rotations_.block<3,3>(0, 3*i)*F.col(i);
             }
         }
     }
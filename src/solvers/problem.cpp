@@ -1,6 +1,10 @@
 #include "solvers/problem.hpp"
+#include "logging/logging.hpp"
 
 #include <iostream>
+#include <algorithm>
+#include <cmath>
+#include <limits>
 using std::chrono::high_resolution_clock;
 using std::chrono::duration_cast;
 using std::chrono::duration;
@@ -10,6 +14,10 @@ namespace function
 {
     ProblemData::ProblemData(int state, int horizon) {
         state_ = state;
+        resize(horizon);
+    }
+
+    void ProblemData::resize(int horizon) {
         horizon_ = horizon;
         num_vars_ = state_*horizon;
 
@@ -28,31 +36,271 @@ namespace function
         q_.setZero();
     }
 
-    void ProblemData::set_data(Eigen::SparseMatrix<double> A, Eigen::VectorXd b, 
-                            Eigen::VectorXd P_k, double rho){
+    void ProblemData::set_data(const Eigen::SparseMatrix<double>& A, const Eigen::VectorXd& b, 
+                            const Eigen::VectorXd& P_k, double rho){
 
         A_ = A; b_ = b; P_k_ = P_k; rho_ = rho;
+        A_.makeCompressed(); Q_.makeCompressed();
+        matrix_free_ = false;
+
+        // the sparsity pattern only changes with the problem size, so ATA_ is 
+        // only analyzed again if it does and its values are refilled otherwise
+        if (!pattern_ready_ || pattern_changed()){
+            analyze_pattern();
+            block_op_ready_ = A_op_.analyze_pattern(A_);
+        }
+        update_hessian();
+        if (use_scaling_){
+            update_scaling();
+        }
+        if (block_op_ready_){
+            A_op_.set_values(A_);
+        }
 
-        ATA_ = 2*(Q_ + rho_*(A_).transpose()*(A_));
         bPk_ = -b_ + P_k_;
-        ATbPk_ = 2.0*rho_*(A_).transpose()*(bPk_) + q_; 
+        ATbPk_.noalias() = 2.0*rho_*(A_).transpose()*(bPk_);
+        ATbPk_ += q_;
+        }
+
+    void ProblemData::set_data(const Eigen::VectorXd& b, const Eigen::VectorXd& P_k, double rho){
+
+        b_ = b; P_k_ = P_k; rho_ = rho;
+        Q_.makeCompressed();
+        matrix_free_ = true;
+
+        bPk_ = -b_ + P_k_;
+        op_apply_transpose_(bPk_, ATbPk_);
+        ATbPk_ *= 2.0*rho_;
+        ATbPk_ += q_;
+    }
+
+    bool ProblemData::pattern_changed() const {
+        auto differs = [](const Eigen::SparseMatrix<double>& M, 
+                            const std::vector<int>& outer, const std::vector<int>& inner){
+            return outer.size() != M.outerSize() + 1 || inner.size() != M.nonZeros() ||
+                    !std::equal(outer.begin(), outer.end(), M.outerIndexPtr()) ||
+                    !std::equal(inner.begin(), inner.end(), M.innerIndexPtr());
+        };
+        return differs(A_, A_outer_, A_inner_) || differs(Q_, Q_outer_, Q_inner_);
+    }
+
+    void ProblemData::analyze_pattern(){
+        const int n = A_.cols();
+        const int* A_outer = A_.outerIndexPtr(); const int* A_inner = A_.innerIndexPtr();
+        const int* Q_outer = Q_.outerIndexPtr(); const int* Q_inner = Q_.innerIndexPtr();
+
+        A_outer_.assign(A_outer, A_outer + A_.outerSize() + 1);
+        A_inner_.assign(A_inner, A_inner + A_.nonZeros());
+        Q_outer_.assign(Q_outer, Q_outer + Q_.outerSize() + 1);
+        Q_inner_.assign(Q_inner, Q_inner + Q_.nonZeros());
+
+        // row wise view of A_ storing (column, value index) of each non zero
+        std::vector<std::vector<std::pair<int, int>>> A_rows(A_.rows());
+        for (int c = 0; c < n; ++c){
+            for (int p = A_outer[c]; p < A_outer[c+1]; ++p){
+                A_rows[A_inner[p]].push_back({c, p});
+            }
+        }
+
+        // pattern of Q_ + A_^T A_ (values are filled in by update_hessian)
+        std::vector<Eigen::Triplet<double>> triplets;
+        for (int j = 0; j < n; ++j){
+            for (int p = A_outer[j]; p < A_outer[j+1]; ++p){
+                for (auto& iq : A_rows[A_inner[p]]){
+                    triplets.push_back(Eigen::Triplet<double>(iq.first, j, 0.0));
+                }
+            }
+            for (int p = Q_outer[j]; p < Q_outer[j+1]; ++p){
+                triplets.push_back(Eigen::Triplet<double>(Q_inner[p], j, 0.0));
+            }
+        }
+        ATA_.resize(n, n);
+        ATA_.setFromTriplets(triplets.begin(), triplets.end());
+        ATA_.makeCompressed();
+
+        // position of each row of the current column in the value array of ATA_
+        std::vector<int> pos(n, -1);
+        ata_ptr_.assign(ATA_.nonZeros() + 1, 0);
+        ata_q_idx_.assign(ATA_.nonZeros(), -1);
+        for (int pass = 0; pass < 2; ++pass){
+            // first pass counts the products per non zero, second pass stores them
+            std::vector<int> next(ata_ptr_.begin(), ata_ptr_.end() - 1);
+            for (int j = 0; j < n; ++j){
+                for (int k = ATA_.outerIndexPtr()[j]; k < ATA_.outerIndexPtr()[j+1]; ++k){
+                    pos[ATA_.innerIndexPtr()[k]] = k;
+                }
+                for (int p = A_outer[j]; p < A_outer[j+1]; ++p){
+                    for (auto& iq : A_rows[A_inner[p]]){
+                        int k = pos[iq.first];
+                        if (pass == 0){
+                            ++ata_ptr_[k+1];
+                        }
+                        else {
+                            ata_lhs_[next[k]] = iq.second; ata_rhs_[next[k]] = p;
+                            ++next[k];
+                        }
+                    }
+                }
+                if (pass == 0){
+                    for (int p = Q_outer[j]; p < Q_outer[j+1]; ++p){
+                        ata_q_idx_[pos[Q_inner[p]]] = p;
+                    }
+                }
+            }
+            if (pass == 0){
+                for (int k = 0; k < ATA_.nonZeros(); ++k){
+                    ata_ptr_[k+1] += ata_ptr_[k];
+                }
+                ata_lhs_.resize(ata_ptr_.back()); ata_rhs_.resize(ata_ptr_.back());
+            }
+        }
+
+        ata_diag_idx_.assign(n, -1);
+        for (int j = 0; j < n; ++j){
+            for (int k = ATA_.outerIndexPtr()[j]; k < ATA_.outerIndexPtr()[j+1]; ++k){
+                if (ATA_.innerIndexPtr()[k] == j){
+                    ata_diag_idx_[j] = k;
+                }
+            }
+        }
+        pattern_ready_ = true;
+    }
+
+    void ProblemData::update_hessian(){
+        const double* A_val = A_.valuePtr();
+        const double* Q_val = Q_.valuePtr();
+        double* ATA_val = ATA_.valuePtr();
+        for (int k = 0; k < ATA_.nonZeros(); ++k){
+            double ata = 0.0;
+            for (int s = ata_ptr_[k]; s < ata_ptr_[k+1]; ++s){
+                ata += A_val[ata_lhs_[s]]*A_val[ata_rhs_[s]];
+            }
+            ata *= rho_;
+            if (ata_q_idx_[k] >= 0){
+                ata += Q_val[ata_q_idx_[k]];
+            }
+            ATA_val[k] = 2*ata;
         }
+    }
+
+    void ProblemData::update_scaling(){
+        const double* ATA_val = ATA_.valuePtr();
+        scaling_.resize(num_vars_);
+        for (int i = 0; i < num_vars_; i += scaling_block_){
+            // the largest diagonal entry of the block keeps the step on the safe side
+            int size = std::min(scaling_block_, num_vars_ - i);
+            double diag = 0.0;
+            for (int j = i; j < i + size; ++j){
+                if (ata_diag_idx_[j] >= 0){
+                    diag = std::max(diag, ATA_val[ata_diag_idx_[j]]);
+                }
+            }
+            scaling_.segment(i, size).setConstant(diag > 0.0 ? 1.0/diag : 1.0);
+        }
+    }
+
+    void ProblemData::apply_A(const Eigen::VectorXd& x, Eigen::VectorXd& Ax) {
+        if (matrix_free_){
+            op_apply_(x, Ax);
+        }
+        else if (block_op_active()){
+            A_op_.apply(x, Ax);
+        }
+        else {
+            Ax.noalias() = A_*x;
+        }
+    }
+
+    void ProblemData::apply_AT(const Eigen::VectorXd& y, Eigen::VectorXd& x) {
+        if (matrix_free_){
+            op_apply_transpose_(y, x);
+        }
+        else {
+            A_op_.apply_transpose(y, x);
+        }
+    }
 
-    double ProblemData::compute_obj(Eigen::VectorXd x_k) {
-        obj_ = x_k.transpose()*Q_*x_k + q_.dot(x_k) + (rho_)*((A_*x_k + bPk_).squaredNorm());
+    double ProblemData::compute_obj(const Eigen::VectorXd& x) {
+        apply_A(x, Ay_k_);
+        obj_ = x.transpose()*Q_*x + q_.dot(x) + (rho_)*((Ay_k_ + bPk_).squaredNorm());
         return obj_;
     }
 
     double ProblemData::compute_obj_diff() {
-        obj_ = (y_k_1 + y_k).transpose()*Q_*(y_k_1 - y_k) + q_.dot(y_k_1 - y_k) + 
-                    (rho_)*(((A_*y_k_1 + bPk_).squaredNorm()) - ((A_*y_k + bPk_).squaredNorm()));
+        // the objective is quadratic, so its change along y_diff follows from the
+        // gradient at y_k and one product with A_ (instead of A_*y_k_1 and A_*y_k)
+        apply_A(y_diff, Ay_diff_);
+        Qy_diff_.noalias() = Q_*y_diff;
+        obj_ = gradient.dot(y_diff) + y_diff.dot(Qy_diff_) + (rho_)*Ay_diff_.squaredNorm();
 
         return obj_;
     }
 
 
     void ProblemData::compute_grad_obj() {
-        gradient = ATA_*y_k + ATbPk_;
+        if (product_form()){
+            // 2*(Q_ + rho_*A_^T A_)*y_k + ATbPk_ without forming the product
+            apply_A(y_k, Ay_k_);
+            Ay_k_ += bPk_;
+            apply_AT(Ay_k_, gradient);
+            gradient *= 2.0*rho_;
+            gradient.noalias() += 2.0*(Q_*y_k);
+            gradient += q_;
+        }
+        else {
+            gradient.noalias() = ATA_*y_k;
+            gradient += ATbPk_;
+        }
+    }
+
+    void ProblemData::set_warm_x(const Eigen::Ref<const Eigen::VectorXd>& x_wm){
+        if (x_wm.size() != num_vars_){
+            BICONVEX_LOG(logging::Level::error, "warm start wrong size. Expected %d, got %d ...", 
+                         num_vars_, int(x_wm.size()));
+            return;
+        }
+        x_k.noalias() = x_wm;
+    }
+
+    double ProblemData::hessian_bound() const {
+        if (matrix_free_){
+            return std::numeric_limits<double>::infinity();
+        }
+        // Gershgorin : the largest eigen value is at most the largest absolute row sum 
+        // (of D*ATA_*D with D^2 = diag(scaling_) if the scaling is used). ATA_ is 
+        // symmetric, so the column sums are used
+        const double* ATA_val = ATA_.valuePtr();
+        const int* ATA_inner = ATA_.innerIndexPtr();
+        const int* ATA_outer = ATA_.outerIndexPtr();
+        double bound = 0.0;
+        for (int j = 0; j < ATA_.outerSize(); ++j){
+            double sum = 0.0;
+            if (use_scaling_){
+                for (int k = ATA_outer[j]; k < ATA_outer[j+1]; ++k){
+                    sum += std::abs(ATA_val[k])*std::sqrt(scaling_[ATA_inner[k]]);
+                }
+                sum *= std::sqrt(scaling_[j]);
+            }
+            else {
+                for (int k = ATA_outer[j]; k < ATA_outer[j+1]; ++k){
+                    sum += std::abs(ATA_val[k]);
+                }
+            }
+            bound = std::max(bound, sum);
+        }
+        return bound;
+    }
+
+    void ProblemData::apply_hessian(const Eigen::VectorXd& x, Eigen::VectorXd& Hx) {
+        if (matrix_free_){
+            apply_A(x, Ax_);
+            apply_AT(Ax_, Hx);
+            Hx *= 2.0*rho_;
+            Hx.noalias() += 2.0*(Q_*x);
+        }
+        else {
+            Hx.noalias() = ATA_*x;
+        }
     }
 
 } //namespace fista
\ No newline at end of file
@@ -29,6 +29,8 @@ PYBIND11_MODULE(gait_planner_cpp, m)
     gp.def("get_percent_in_phase", py::overload_cast<double>
             (&gait_planner::QuadrupedGait::get_percent_in_phase));
     gp.def("get_contact_phase_plan", &gait_planner::QuadrupedGait::get_contact_phase_plan);
+    gp.def("get_phase_table", &gait_planner::QuadrupedGait::get_phase_table);
+    gp.def("get_percent_in_phase_table", &gait_planner::QuadrupedGait::get_percent_in_phase_table);
 
     //Setters
     gp.def("get_phi", &gait_planner::QuadrupedGait::set_step_height);
@@ -11,6 +11,8 @@
 using namespace ik;
 namespace py = pybind11;
 
+// optimize releases the GIL. The IK must not be used from another thread while it solves
+
 
 
 PYBIND11_MODULE(inverse_kinematics_cpp, m)
@@ -20,7 +22,9 @@ PYBIND11_MODULE(inverse_kinematics_cpp, m)
     py::class_<ik::InverseKinematics> ik (m, "InverseKinematics");
     ik.def(py::init<std::string, int>());
     ik.def("setup_costs", &ik::InverseKinematics::setup_costs);
-    ik.def("optimize", &ik::InverseKinematics::optimize);
+    ik.def("optimize", &ik::InverseKinematics::optimize, py::arg("x0"), py::arg("time_limit_us") = 0.0,
+           py::call_guard<py::gil_scoped_release>());
+    ik.def("return_time_limit_reached", &ik::InverseKinematics::return_time_limit_reached);
     ik.def("get_xs", &ik::InverseKinematics::get_xs);
     ik.def("get_us", &ik::InverseKinematics::get_us);
     ik.def("return_opt_com", &ik::InverseKinematics::return_opt_com);
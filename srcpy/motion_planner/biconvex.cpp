@@ -1,25 +1,84 @@
 // This file contains python bindings for biconvex motion planner
 
+#include <algorithm>
+
 #include <pybind11/stl.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/numpy.h>
 #include <pybind11/eigen.h>
 
 #include <motion_planner/biconvex.hpp>
+#include <motion_planner/batch.hpp>
 #include <motion_planner/kino_dyn.hpp>
 
 using namespace motion_planner;
 using namespace dynamics;
 namespace py = pybind11;
 
+// Thread safety : the solves (optimize, optimize_osqp, optimize_batch) release the GIL, so
+// other python threads (e.g. the control loop) keep running during a solve. A planner
+// must not be used from another thread while it solves (this includes the setters and
+// the return_* functions, and the dynamics of a KinoDynMP). Different planners can be
+// solved in parallel. The logging functions can be called from any thread.
 PYBIND11_MODULE(biconvex_mpc_cpp, m)
 {
     m.doc() = "Biconvex motion planner";
 
+    py::enum_<function::Acceleration>(m, "Acceleration")
+        .value("nesterov", function::Acceleration::nesterov)
+        .value("gradient_restart", function::Acceleration::gradient_restart)
+        .value("function_restart", function::Acceleration::function_restart)
+        .value("greedy", function::Acceleration::greedy);
+
+    py::enum_<motion_planner::Status>(m, "Status")
+        .value("converged", motion_planner::Status::converged)
+        .value("max_iters", motion_planner::Status::max_iters)
+        .value("time_limit", motion_planner::Status::time_limit)
+        .value("diverged", motion_planner::Status::diverged);
+
     py::class_<motion_planner::BiConvexMP> mp (m, "BiconvexMP");
+
+    // column indices of the telemetry array
+    py::enum_<motion_planner::BiConvexMP::TelemetryField>(mp, "TelemetryField", py::arithmetic())
+        .value("fista_iters_x", motion_planner::BiConvexMP::fista_iters_x)
+        .value("fista_iters_f", motion_planner::BiConvexMP::fista_iters_f)
+        .value("step_x", motion_planner::BiConvexMP::step_x)
+        .value("step_f", motion_planner::BiConvexMP::step_f)
+        .value("line_search_x", motion_planner::BiConvexMP::line_search_x)
+        .value("line_search_f", motion_planner::BiConvexMP::line_search_f)
+        .value("obj_x", motion_planner::BiConvexMP::obj_x)
+        .value("obj_f", motion_planner::BiConvexMP::obj_f)
+        .value("primal_res", motion_planner::BiConvexMP::primal_res)
+        .value("dual_res", motion_planner::BiConvexMP::dual_res)
+        .value("rho", motion_planner::BiConvexMP::rho)
+        .value("time_f", motion_planner::BiConvexMP::time_f)
+        .value("time_x", motion_planner::BiConvexMP::time_x)
+        .value("time_update", motion_planner::BiConvexMP::time_update)
+        .export_values();
     mp.def(py::init<double, int, int>());
     mp.def("set_contact_plan", &motion_planner::BiConvexMP::set_contact_plan);
-    mp.def("set_rotation_matrix_f", &motion_planner::BiConvexMP::set_rotation_matrix_f);
+    // contact plan of the horizon as a (n_col, n_eff, 4) array and the time step of each knot
+    mp.def("set_contact_plan_horizon", [](motion_planner::BiConvexMP& self, 
+                py::array_t<double, py::array::c_style | py::array::forcecast> cnt_plan,
+                Eigen::Ref<const Eigen::VectorXd> dt){
+        if (cnt_plan.ndim() != 3 || cnt_plan.shape(0) != self.return_n_col() || 
+            cnt_plan.shape(1) != self.return_n_eff() || cnt_plan.shape(2) != 4){
+            throw py::value_error("set_contact_plan_horizon expects a (n_col, n_eff, 4) contact plan");
+        }
+        if (dt.size() != self.return_n_col()){
+            throw py::value_error("set_contact_plan_horizon expects n_col time steps");
+        }
+        self.set_contact_plan_horizon(Eigen::Map<const dynamics::CentroidalDynamics::ContactPlan>(
+                    cnt_plan.data(), cnt_plan.shape(0)*cnt_plan.shape(1), 4), dt);
+    });
+    mp.def("return_n_col", &motion_planner::BiConvexMP::return_n_col);
+    mp.def("return_n_eff", &motion_planner::BiConvexMP::return_n_eff);
+    mp.def("set_contact_location", &motion_planner::BiConvexMP::set_contact_location);
+    mp.def("set_rotation_matrix_f", &motion_planner::BiConvexMP::set_rotation_matrix_f,
+           "Sets the rotation of the friction cone of end effector n at knot t (z axis along the "
+           "contact normal). Replaces set_rotation_matrix_f(R), which appended the rotations in order.",
+           py::arg("t"), py::arg("n"), py::arg("rot_matrix"));
+    mp.def("set_contact_normals", &motion_planner::BiConvexMP::set_contact_normals);
     mp.def("return_A_x", &motion_planner::BiConvexMP::return_A_x);
     mp.def("return_b_x", &motion_planner::BiConvexMP::return_b_x);
     mp.def("return_A_f", &motion_planner::BiConvexMP::return_A_f);
@@ -31,23 +90,110 @@ PYBIND11_MODULE(biconvex_mpc_cpp, m)
     mp.def("set_bounds_x", &motion_planner::BiConvexMP::set_bounds_x);
     mp.def("set_bounds_f", &motion_planner::BiConvexMP::set_bounds_f);
     mp.def("create_bound_constraints", &motion_planner::BiConvexMP::create_bound_constraints);
+    mp.def("set_force_limits", &motion_planner::BiConvexMP::set_force_limits, 
+           py::arg("f_max"), py::arg("enforce") = false);
+    mp.def("update_bounds_f", &motion_planner::BiConvexMP::update_bounds_f);
+    mp.def("set_friction_coefficient", &motion_planner::BiConvexMP::set_friction_coefficient);
+    mp.def("set_friction_coefficients", &motion_planner::BiConvexMP::set_friction_coefficients);
+    mp.def("update_friction_coefficients", &motion_planner::BiConvexMP::update_friction_coefficients);
     mp.def("set_rho", &motion_planner::BiConvexMP::set_rho);
-    mp.def("return_opt_x", &motion_planner::BiConvexMP::return_opt_x);
-    mp.def("return_opt_f", &motion_planner::BiConvexMP::return_opt_f);
-    mp.def("return_opt_p", &motion_planner::BiConvexMP::return_opt_p);
-    mp.def("return_opt_com", &motion_planner::BiConvexMP::return_opt_com);
-    mp.def("return_opt_mom", &motion_planner::BiConvexMP::return_opt_mom);
+    mp.def("set_adaptive_rho", &motion_planner::BiConvexMP::set_adaptive_rho, py::arg("use_adaptive_rho"), 
+           py::arg("mu"), py::arg("tau"), py::arg("keep_rho") = false);
+    mp.def("set_rho_limits", &motion_planner::BiConvexMP::set_rho_limits);
+    mp.def("set_exit_tol", &motion_planner::BiConvexMP::set_exit_tol);
+    mp.def("set_fista_tol", &motion_planner::BiConvexMP::set_fista_tol);
+    mp.def("set_inexact_tol", &motion_planner::BiConvexMP::set_inexact_tol);
+    mp.def("set_fixed_step", &motion_planner::BiConvexMP::set_fixed_step);
+    mp.def("set_scaling", &motion_planner::BiConvexMP::set_scaling);
+    mp.def("set_matrix_free", &motion_planner::BiConvexMP::set_matrix_free);
+    mp.def("set_compress_forces", &motion_planner::BiConvexMP::set_compress_forces);
+    mp.def("set_acceleration_x", &motion_planner::BiConvexMP::set_acceleration_x);
+    mp.def("set_acceleration_f", &motion_planner::BiConvexMP::set_acceleration_f);
+    mp.def("return_opt_x", &motion_planner::BiConvexMP::return_opt_x, py::return_value_policy::reference_internal);
+    mp.def("return_opt_f", &motion_planner::BiConvexMP::return_opt_f, py::return_value_policy::reference_internal);
+    mp.def("return_opt_p", &motion_planner::BiConvexMP::return_opt_p, py::return_value_policy::reference_internal);
+    mp.def("return_opt_com", &motion_planner::BiConvexMP::return_opt_com, py::return_value_policy::reference_internal);
+    mp.def("return_opt_mom", &motion_planner::BiConvexMP::return_opt_mom, py::return_value_policy::reference_internal);
 
     mp.def("set_warm_start_vars", &motion_planner::BiConvexMP::set_warm_start_vars);
-    mp.def("optimize", &motion_planner::BiConvexMP::optimize);
+    mp.def("shift_horizon", &motion_planner::BiConvexMP::shift_horizon, py::arg("n_knots") = 1);
+    mp.def("update_cost_x", &motion_planner::BiConvexMP::update_cost_x);
+    mp.def("update_bounds_x", &motion_planner::BiConvexMP::update_bounds_x);
+    mp.def("optimize", &motion_planner::BiConvexMP::optimize, 
+           py::arg("x_init"), py::arg("num_iters"), py::arg("time_limit_us") = 0.0,
+           py::call_guard<py::gil_scoped_release>());
+    mp.def("return_status", &motion_planner::BiConvexMP::return_status);
+    mp.def("return_residual", &motion_planner::BiConvexMP::return_residual);
     mp.def("return_dyn_viol_hist", &motion_planner::BiConvexMP::return_dyn_viol_hist);
+    mp.def("set_telemetry", &motion_planner::BiConvexMP::set_telemetry);
+    mp.def("return_telemetry", &motion_planner::BiConvexMP::return_telemetry, py::return_value_policy::reference_internal);
     mp.def("collect_statistics", &motion_planner::BiConvexMP::collect_statistics);
+    mp.def("return_fista_iters", &motion_planner::BiConvexMP::return_fista_iters);
 
     #ifdef USE_OSQP
-        mp.def("optimize_osqp", &motion_planner::BiConvexMP::optimize_osqp);
+        mp.def("optimize_osqp", &motion_planner::BiConvexMP::optimize_osqp,
+               py::call_guard<py::gil_scoped_release>());
     #endif
 
 
+    // logging (messages are buffered and only printed by flush_log)
+    py::enum_<logging::Level>(m, "LogLevel")
+        .value("debug", logging::Level::debug)
+        .value("info", logging::Level::info)
+        .value("warning", logging::Level::warning)
+        .value("error", logging::Level::error)
+        .value("off", logging::Level::off);
+
+    py::class_<logging::Message> msg (m, "LogMessage");
+    msg.def_readonly("level", &logging::Message::level);
+    msg.def_readonly("time", &logging::Message::time);
+    msg.def_readonly("text", &logging::Message::text);
+
+    m.def("set_log_level", [](logging::Level level){ logging::logger().set_level(level); });
+    m.def("drain_log", [](){ return logging::logger().drain(); });
+    m.def("flush_log", [](){ logging::logger().flush(std::cout); });
+    m.def("dropped_log_messages", [](){ return logging::logger().dropped(); });
+
+    // solves the planners in parallel (without the GIL) and returns the optimal com 
+    // (n x (n_col+1) x 3), momentum (n x (n_col+1) x 6) and forces (n x n_col x 3*n_eff)
+    m.def("optimize_batch", [](std::vector<motion_planner::BiConvexMP*> problems, 
+                               std::vector<Eigen::VectorXd> x_init, int num_iters, int n_threads){
+        if (problems.size() != x_init.size()){
+            throw py::value_error("optimize_batch expects one x_init per problem");
+        }
+        std::vector<motion_planner::BiConvexMP*> sorted(problems);
+        std::sort(sorted.begin(), sorted.end());
+        if (std::adjacent_find(sorted.begin(), sorted.end()) != sorted.end()){
+            throw py::value_error("optimize_batch expects distinct problems");
+        }
+        const py::ssize_t n = problems.size();
+        const py::ssize_t n_knots = n > 0 ? problems[0]->return_opt_com().rows() : 1;
+        const py::ssize_t n_f = n > 0 ? problems[0]->return_opt_f().size()/(n_knots - 1) : 0;
+        for (motion_planner::BiConvexMP* problem : problems){
+            if (problem->return_opt_com().rows() != n_knots || 
+                    problem->return_opt_f().size() != (n_knots - 1)*n_f){
+                throw py::value_error("optimize_batch expects problems of the same size");
+            }
+        }
+
+        {
+            py::gil_scoped_release release;
+            motion_planner::optimize_batch(problems, x_init, num_iters, n_threads);
+        }
+
+        // the arrays are row major (C order) like the Eigen matrices mapped on them
+        typedef Eigen::Matrix<double, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor> RowMatrixXd;
+        py::array_t<double> com({n, n_knots, py::ssize_t(3)});
+        py::array_t<double> mom({n, n_knots, py::ssize_t(6)});
+        py::array_t<double> f({n, n_knots - 1, n_f});
+        for (py::ssize_t i = 0; i < n; ++i){
+            Eigen::Map<RowMatrixXd>(com.mutable_data(i), n_knots, 3) = problems[i]->return_opt_com();
+            Eigen::Map<RowMatrixXd>(mom.mutable_data(i), n_knots, 6) = problems[i]->return_opt_mom();
+            Eigen::Map<Eigen::VectorXd>(f.mutable_data(i), (n_knots - 1)*n_f) = problems[i]->return_opt_f();
+        }
+        return py::make_tuple(com, mom, f);
+    });
+
     py::class_<dynamics::CentroidalDynamics> dyn (m, "CentroidalDynamics");
     dyn.def(py::init<double, int, int>());
     // dyn.def("create_contact_array", &dynamics::CentroidalDynamics::create_contact_array);
@@ -56,9 +202,15 @@ PYBIND11_MODULE(biconvex_mpc_cpp, m)
     kd.def(py::init<std::string, double, int, int, int>());
     kd.def("return_dyn", &motion_planner::KinoDynMP::return_dyn, py::return_value_policy::reference);
     kd.def("return_ik", &motion_planner::KinoDynMP::return_ik, py::return_value_policy::reference);
-    kd.def("optimize", &motion_planner::KinoDynMP::optimize);
+    kd.def("optimize", &motion_planner::KinoDynMP::optimize, py::arg("q"), py::arg("v"), 
+           py::arg("dyn_iters"), py::arg("kino_dyn_iters"), py::arg("time_limit_us") = 0.0,
+           py::call_guard<py::gil_scoped_release>());
     kd.def("set_com_tracking_weight", &motion_planner::KinoDynMP::set_com_tracking_weight);
     kd.def("set_mom_tracking_weight", &motion_planner::KinoDynMP::set_mom_tracking_weight);
+    kd.def("set_warm_start_shift", &motion_planner::KinoDynMP::set_warm_start_shift,
+           py::arg("use_shift"), py::arg("n_knots") = 1);
+    kd.def("set_ik_time_fraction", &motion_planner::KinoDynMP::set_ik_time_fraction);
+    kd.def("return_status", &motion_planner::KinoDynMP::return_status);
     kd.def("compute_solve_times", &motion_planner::KinoDynMP::compute_solve_times);
     kd.def("return_solve_times", &motion_planner::KinoDynMP::return_solve_times, py::return_value_policy::reference);
 